@@ -1,13 +1,62 @@
 #!/usr/bin/env python3
 
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
 from flask import Flask
-from routes.pesapal_service import pesapal_blueprint
+from import_profile import ImportProfile
+
+logger = logging.getLogger(__name__)
+
+"""
+worker boot must stay within this many seconds.
+nothing in create_app waits on Pesapal or the database
+"""
+BOOT_BUDGET_SECONDS = float(os.getenv('KITSUNE_BOOT_BUDGET', 2.0))
+
+
+def warm_pesapal_token():
+    """
+    function definition that fetches the first Pesapal token in the
+    background, so the first payment request does not pay for it
+    """
+    from services.pesapal_service import token_cache
+
+    def warm():
+        try:
+            token_cache.get_token()
+        except Exception as e:
+            logger.warning(f"Could not warm Pesapal token: {e}")
+
+    threading.Thread(target=warm, name='pesapal-token-warmup', daemon=True).start()
+
 
 def create_app():
+    started = time.perf_counter()
+    profile = ImportProfile() if os.getenv('KITSUNE_IMPORT_PROFILE') == '1' else None
+
+    with profile.record() if profile else nullcontext():
+        from routes.pesapal_service import pesapal_blueprint
+
     app = Flask(__name__)
     app.config['DEBUG'] = True
     app.register_blueprint(pesapal_blueprint)
 
+    if os.getenv('KITSUNE_WARM_PESAPAL') == '1':
+        warm_pesapal_token()
+
+    boot_seconds = time.perf_counter() - started
+    app.config['BOOT_SECONDS'] = boot_seconds
+    if profile:
+        print(f"Import profile:\n{profile.report()}", file=sys.stderr)
+    if boot_seconds > BOOT_BUDGET_SECONDS:
+        logger.error(f"App boot took {boot_seconds:.2f}s, over the {BOOT_BUDGET_SECONDS}s budget")
+    else:
+        logger.info(f"App boot took {boot_seconds:.2f}s")
+
     return app
 
 if __name__ == "__main__":
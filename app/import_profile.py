@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+opt-in import-time profiler used while the app boots.
+enable it with KITSUNE_IMPORT_PROFILE=1
+"""
+import builtins
+import sys
+import time
+from contextlib import contextmanager
+from importlib.util import resolve_name
+
+
+class ImportProfile:
+    """
+    class definition that records how long each newly
+    loaded module took to import, children included
+    """
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def record(self):
+        original_import = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level and globals:
+                module = resolve_name('.' * level + name, globals.get('__package__'))
+            else:
+                module = name
+            if module in sys.modules:
+                return original_import(name, globals, locals, fromlist, level)
+            started = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                self.timings.setdefault(module, time.perf_counter() - started)
+
+        builtins.__import__ = timed_import
+        try:
+            yield self
+        finally:
+            builtins.__import__ = original_import
+
+    def report(self, top: int = 20) -> str:
+        """
+        method definition that formats the slowest imports
+        """
+        slowest = sorted(self.timings.items(), key=lambda item: item[1], reverse=True)[:top]
+        lines = [f"{'module':<50} {'ms':>10}"]
+        lines += [f"{name:<50} {seconds * 1000:>10.1f}" for name, seconds in slowest]
+        return '\n'.join(lines)
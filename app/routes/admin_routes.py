@@ -6,11 +6,12 @@ these are the routes for the admin model
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash
 from storage import Storage
+from models.lazy import LazyObject
 from models.admin import Admin
 import logging
 
 admin_bp = Blueprint('admin', __name__)
-storage = Storage()
+storage = LazyObject(Storage)
 
 @admin_bp.route('/admins', methods=['POST'])
 def create_admin():
@@ -3,13 +3,46 @@
 """
 these are the routes for the analytics model
 """
-from flask import Blueprint, jsonify, request
+import json
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
-from models.analytics import Analytics
+from models.analytics import Analytics, BufferFullError, period_bounds, statistics_window
+from models.streaming import EXPORT_FORMATS
 
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/analytics')
 
+MAX_BATCH_SIZE = 5000
+MAX_PAGE_SIZE = 1000
+
+
+def metric_row(data):
+    """
+    Build an insertable metric row from a request payload.
+    """
+    if not isinstance(data, dict) or not data.get('metric_type') or data.get('metric_value') is None:
+        raise ValueError('metric_type and metric_value are required')
+    return {
+        'user_id': data.get('user_id'),
+        'task_id': data.get('task_id'),
+        'metric_type': data['metric_type'],
+        'metric_value': str(data['metric_value']),
+        'timestamp': datetime.now(),
+        'report_data': data.get('report_data')
+    }
+
+
+def buffer_metrics(rows):
+    """
+    Queue metric rows for the background writer.
+    A full buffer is reported as 503 so clients back off and retry.
+    """
+    try:
+        Analytics.buffer_metrics(rows)
+    except BufferFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    return jsonify({'message': f'{len(rows)} metric(s) accepted'}), 202
+
 @analytics_bp.route('/record', methods=['POST'])
 def record_metric():
     """
@@ -19,54 +52,96 @@ def record_metric():
     if not data:
         return jsonify({'error': 'No data provided'}), 400
 
-    metric = Analytics(
-        user_id=data.get('user_id'),
-        task_id=data.get('task_id'),
-        metric_type=data.get('metric_type'),
-        metric_value=data.get('metric_value'),
-        timestamp=datetime.now()
-    )
+    try:
+        row = metric_row(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return buffer_metrics([row])
+
+@analytics_bp.route('/record_batch', methods=['POST'])
+def record_metric_batch():
+    """
+    Route to record an array of metric values in one request.
+    """
+    data = request.get_json()
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Expected a non-empty array of metrics'}), 400
+    if len(data) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} metrics per batch'}), 413
 
     try:
-        metric.record_metric()
-        return jsonify({'message': 'Metric recorded successfully'}), 201
-    except SQLAlchemyError as e:
-        return jsonify({'error': f'Failed to record metric: {str(e)}'}), 500
+        rows = [metric_row(item) for item in data]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return buffer_metrics(rows)
 
 @analytics_bp.route('/fetch', methods=['GET'])
 def fetch_metrics():
     """
-    Route to fetch metrics based on user_id and/or metric_type.
+    Route to fetch one page of metrics based on user_id and/or metric_type.
+    Supports fields=a,b projection, start/end ISO time filters and
+    cursor/limit keyset paging. The query runs before the response
+    starts, so database errors still return 500; the page is then
+    streamed as it is read.
     """
-    user_id = request.args.get('user_id')
-    metric_type = request.args.get('metric_type')
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else None
+    limit = max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE_SIZE))
 
     try:
-        metrics = Analytics.fetch_metrics(user_id=user_id, metric_type=metric_type)
-        metrics_data = [
-            {
-                "analytics_id": metric.analytics_id,
-                "user_id": metric.user_id,
-                "task_id": metric.task_id,
-                "metric_type": metric.metric_type,
-                "metric_value": metric.metric_value,
-                "timestamp": metric.timestamp.isoformat(),
-                "report_data": metric.report_data
-            } for metric in metrics
-        ]
-        return jsonify(metrics_data), 200
+        start = request.args.get('start')
+        end = request.args.get('end')
+        query = Analytics.page_query(
+            user_id=request.args.get('user_id'),
+            metric_type=request.args.get('metric_type'),
+            fields=fields,
+            start=datetime.fromisoformat(start) if start else None,
+            end=datetime.fromisoformat(end) if end else None,
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+        rows = iter(query.yield_per(500))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except SQLAlchemyError as e:
         return jsonify({'error': f'Failed to fetch metrics: {str(e)}'}), 500
 
+    def generate():
+        yield '{"data": ['
+        last = None
+        next_cursor = None
+        for count, row in enumerate(rows):
+            if count == limit:
+                next_cursor = Analytics.encode_cursor(last.timestamp, last.analytics_id)
+                break
+            record = {field: row._mapping[field] for field in fields or row._fields}
+            if record.get('timestamp'):
+                record['timestamp'] = record['timestamp'].isoformat()
+            yield (',' if count else '') + json.dumps(record, default=str)
+            last = row
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @analytics_bp.route('/analyze', methods=['GET'])
 def analyze_trends():
     """
     Route to analyze trends over a specified time period.
+    Pass stats=p50,p95,histogram,series,ewma,rolling,... (and
+    optionally bucket=1h) for statistics beyond the averages.
     """
     time_period = request.args.get('time_period', '7d')
+    metric_type = request.args.get('metric_type')
+    stats = request.args.get('stats')
+    bucket = request.args.get('bucket', '1h')
 
     try:
-        trends = Analytics.analyze_trends(time_period)
+        if stats:
+            statistics_window(time_period, bucket)
+            trends = Analytics.analyze_statistics(time_period, stats.split(','), metric_type, bucket)
+        else:
+            period_bounds(time_period)
+            trends = Analytics.analyze_trends(time_period, metric_type)
         return jsonify(trends), 200
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
@@ -76,15 +151,23 @@ def analyze_trends():
 @analytics_bp.route('/export', methods=['GET'])
 def export_data():
     """
-    Route to export analytics data in JSON or CSV format.
+    Route to stream analytics data as JSON, JSON Lines or CSV.
+    Pass gzip=1 to receive a gzipped file.
     """
     file_format = request.args.get('file_format', 'json')
-    file_path = request.args.get('file_path', 'analytics_export')
+    compress = request.args.get('gzip') in ('1', 'true')
 
     try:
-        Analytics.export_data(file_format=file_format, file_path=file_path)
-        return jsonify({'message': f'Data exported successfully to {file_path}.{file_format}'}), 200
+        chunks = Analytics.stream_export(file_format=file_format, compress=compress)
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except SQLAlchemyError as e:
         return jsonify({'error': f'Failed to export data: {str(e)}'}), 500
+
+    file_name = f"analytics_export.{file_format}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[file_format]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={file_name}'}
+    )
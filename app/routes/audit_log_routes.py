@@ -3,13 +3,16 @@
 these are the routes for the audit logs model
 """
 import logging
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from datetime import datetime
-from models.audit_logs imprt AuditLog
+from models.audit_logs import AuditLog
+from models.streaming import EXPORT_FORMATS
 
-audit_log = blueprint('audit_log_bp', __name__)
+audit_log_bp = Blueprint('audit_log_bp', __name__)
 logger = logging.getLogger(__name__)
 
+MAX_PAGE_SIZE = 1000
+
 @audit_log_bp.route('/log_action', methods=['POST'])
 def log_action():
     data = request.json
@@ -19,6 +22,11 @@ def log_action():
         if field not in data:
             return jsonify({"error": f"{field} is required"}), 400
 
+    try:
+        AuditLog.validate_entry(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     audit_log = AuditLog(
         user_id=data['user_id'],
         action_type=data['action_type'],
@@ -31,11 +39,15 @@ def log_action():
 
     try:
         audit_log.log_action()
-        return jsonify({"message": "Action logged successfully"}), 201
+        return jsonify({"message": "Action queued for logging"}), 202
     except Exception as e:
         logger.error(f"Failed to log action: {e}")
         return jsonify({"error": "Failed to log action"}), 500
 
+@audit_log_bp.route('/writer_metrics', methods=['GET'])
+def writer_metrics():
+    return jsonify(AuditLog.writer_metrics()), 200
+
 @audit_log_bp.route('/fetch_logs', methods=['GET'])
 def fetch_logs():
     user_id = request.args.get('user_id')
@@ -53,8 +65,14 @@ def fetch_logs():
             return jsonify({"error": "Invalid date format. Use ISO format"}), 400
 
     try:
-        logs = AuditLog.fetch_logs(user_id=user_id, entity_type=entity_type, date_range=date_range)
-        return jsonify([log.serialize() for log in logs]), 200
+        include_archive = request.args.get('include_archive') in ('1', 'true')
+        limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PAGE_SIZE)
+        logs, next_cursor = AuditLog.fetch_logs(user_id=user_id, entity_type=entity_type,
+                                                date_range=date_range, include_archive=include_archive,
+                                                cursor=request.args.get('cursor'), limit=limit)
+        return jsonify({"data": [log.serialize() for log in logs], "next_cursor": next_cursor}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Failed to fetch logs: {e}")
         return jsonify({"error": "Failed to fetch logs"}), 500
@@ -62,12 +80,17 @@ def fetch_logs():
 @audit_log_bp.route('/search_logs', methods=['GET'])
 def search_logs():
     keyword = request.args.get('keyword')
+    mode = request.args.get('mode', 'and')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
 
     if not keyword:
         return jsonify({"error": "Keyword is required"}), 400
+    if mode not in ('and', 'or'):
+        return jsonify({"error": "mode must be 'and' or 'or'"}), 400
 
     try:
-        logs = AuditLog.search_logs(keyword)
+        logs = AuditLog.search_logs(keyword, mode=mode, page=page, per_page=per_page)
         return jsonify([log.serialize() for log in logs]), 200
     except Exception as e:
         logger.error(f"Failed to search logs: {e}")
@@ -75,14 +98,44 @@ def search_logs():
 
 @audit_log_bp.route('/export_logs', methods=['GET'])
 def export_logs():
+    """
+    Route to stream logs as CSV, JSON Lines or JSON, filtered like
+    fetch_logs && filter_logs. Pass gzip=1 to receive a gzipped file.
+    """
     file_format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') in ('1', 'true')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    date_range = None
+
+    if start_date and end_date:
+        try:
+            date_range = (datetime.fromisoformat(start_date), datetime.fromisoformat(end_date))
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Use ISO format"}), 400
+
     try:
-        file_path = AuditLog.export_logs(file_format)
-        return send_file(file_path, as_attachment=True)
+        chunks = AuditLog.export_logs(
+            file_format, compress=compress,
+            user_id=request.args.get('user_id'),
+            entity_type=request.args.get('entity_type'),
+            date_range=date_range,
+            status=request.args.get('status'),
+            action_type=request.args.get('action_type'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Failed to export logs: {e}")
         return jsonify({"error": "Failed to export logs"}), 500
 
+    file_name = f"audit_logs.{file_format}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[file_format]
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={file_name}'}
+    )
+
 @audit_log_bp.route('/generate_summary', methods=['GET'])
 def generate_summary():
     start_date = request.args.get('start_date')
@@ -4,13 +4,53 @@ these are the routes for the location model
 """
 # location_routes.py
 
+import os
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
+from sqlalchemy import or_
 from models import db
+from models.geo_grid import grid_nearby, sync_locations
+from models.location_clusters import cluster_service, cluster_snapshot
 from models.locations import Location
-from models.task import Task
+from models.tasks import Task, TaskStatusEnum
 
 location_bp = Blueprint('location', __name__, url_prefix='/locations')
 
+MAX_BULK_PINGS = 5000
+
+
+def latest_pings(pings):
+    """
+    Validate position pings and keep each user's latest one, by its
+    ISO `timestamp` when given, else by its order in the request.
+    Timestamps without an offset are taken as UTC.
+    Returns (pings, indexes of rejected pings).
+    """
+    latest = {}
+    rejected = []
+    for index, ping in enumerate(pings):
+        try:
+            user_id = int(ping['user_id'])
+            latitude = float(ping['latitude'])
+            longitude = float(ping['longitude'])
+            timestamp = datetime.fromisoformat(ping['timestamp']) if ping.get('timestamp') else None
+            if timestamp is not None:
+                timestamp = (timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None
+                             else timestamp.astimezone(timezone.utc))
+            address = ping.get('address')
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError('coordinates out of range')
+            if address is not None and (not isinstance(address, str) or len(address) > 255):
+                raise ValueError('address must be a string of at most 255 characters')
+        except (KeyError, TypeError, ValueError, OverflowError):
+            rejected.append(index)
+            continue
+        key = (timestamp is not None, timestamp or datetime.min.replace(tzinfo=timezone.utc), index)
+        if user_id not in latest or key >= latest[user_id][0]:
+            latest[user_id] = (key, {'user_id': user_id, 'latitude': latitude,
+                                     'longitude': longitude, 'address': address})
+    return [ping for _, ping in latest.values()], rejected
+
 @location_bp.route('/create', methods=['POST'])
 def create_location():
     data = request.get_json()
@@ -28,9 +68,38 @@ def create_location():
 
     return jsonify({'message': 'Location created successfully', 'location_id': location.id}), 201
 
+@location_bp.route('/bulk-upsert', methods=['POST'])
+def bulk_upsert_locations():
+    """
+    Route to apply many position pings in one request. Each user's
+    tracked location moves to their latest ping, in one transaction.
+    """
+    data = request.get_json(silent=True) or {}
+    pings = data.get('pings') if isinstance(data, dict) else data
+    if not isinstance(pings, list) or not pings:
+        return jsonify({'error': 'pings must be a non-empty list'}), 400
+    if len(pings) > MAX_BULK_PINGS:
+        return jsonify({'error': f'At most {MAX_BULK_PINGS} pings per request'}), 413
+
+    latest, rejected = latest_pings(pings)
+    if not latest:
+        return jsonify({'error': 'No valid pings', 'rejected': rejected}), 400
+
+    try:
+        location_ids = Location.upsert_positions(db.session, latest)
+    except Exception as e:
+        return jsonify({'error': f'Failed to upsert locations: {str(e)}'}), 500
+    sync_locations(db.session, location_ids)
+
+    return jsonify({
+        'upserted': len(latest),
+        'deduplicated': len(pings) - len(rejected) - len(latest),
+        'rejected': rejected
+    }), 200
+
 @location_bp.route('/update/<int:location_id>', methods=['PUT'])
 def update_location(location_id):
-    location = Location.query.get(location_id)
+    location = db.session.get(Location, location_id)
     if not location:
         return jsonify({'error': 'Location not found'}), 404
 
@@ -42,6 +111,7 @@ def update_location(location_id):
         radius=data.get('radius')
     )
     db.session.commit()
+    sync_locations(db.session, [location_id])
 
     return jsonify({'message': 'Location updated successfully'})
 
@@ -66,16 +136,59 @@ def find_nearby_tasks():
     current_latitude = request.args.get('latitude', type=float)
     current_longitude = request.args.get('longitude', type=float)
     radius = request.args.get('radius', type=float, default=18.0)
+    limit = min(max(request.args.get('limit', type=int, default=50), 1), 200)
+    k = request.args.get('k', type=int)
+
+    if current_latitude is None or current_longitude is None:
+        return jsonify({'error': 'latitude and longitude are required'}), 400
 
-    nearby_tasks = Location.find_nearby_tasks(db.session, current_latitude, current_longitude, radius)
+    # open tasks come from the in-memory grid, which may lag changes made through
+    # other workers by up to its rebuild interval, so the title lookup re-checks
+    # that each task is still open
+    hits = grid_nearby(current_latitude, current_longitude, radius, limit, k and min(k, 200))
+    if hits is None:
+        # the grid is still building or failing: the indexed database search
+        # answers instead, with the k nearest taken from within the radius
+        tasks = Location.find_nearby_tasks(db.session, current_latitude, current_longitude,
+                                           radius, min(k, 200) if k else limit)
+        return jsonify([{
+            'task_id': task.id,
+            'task_name': task.title,
+            'latitude': task.location.latitude,
+            'longitude': task.location.longitude,
+            'distance_km': task.distance_km
+        } for task in tasks])
+    titles = dict(db.session.query(Task.id, Task.title).filter(
+        Task.id.in_([hit[0] for hit in hits]),
+        Task.assigned_tasker_id.is_(None),
+        or_(Task.status.is_(None), Task.status == TaskStatusEnum.PENDING)).all())
     return jsonify([{
-        'task_id': task.id,
-        'task_name': task.name,
-        'latitude': task.location.latitude,
-        'longitude': task.location.longitude
-    } for task in nearby_tasks])
+        'task_id': task_id,
+        'task_name': titles.get(task_id),
+        'latitude': latitude,
+        'longitude': longitude,
+        'distance_km': round(distance, 3)
+    } for task_id, latitude, longitude, distance in hits if task_id in titles])
 
 @location_bp.route('/cluster', methods=['GET'])
 def cluster_locations():
-    clusters = Location.cluster_locations(db.session)
-    return jsonify({'clusters': clusters.tolist()})
+    """
+    Route to serve the latest clusters computed in the background.
+    The ETag is the cluster version, so unchanged clusters return 304.
+    """
+    if os.getenv('LOCATION_CLUSTERING') == '1':
+        cluster_service.start()
+
+    snapshot = cluster_snapshot.get(db.session)
+    if snapshot is None:
+        response = jsonify({'error': 'Clusters are still being computed'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    etag = f"clusters-v{snapshot['version']}"
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    response = jsonify(snapshot)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -4,12 +4,61 @@
 routes necessary for pesapal integration
 """
 
+import logging
+import os
 from flask import Blueprint, request, jsonify
+from services.idempotency import IdempotencyConflict, IdempotencyManager, store_from_env
+from services.ipn_queue import IPNWorkerPool, PaymentStateStore
 from services.pesapal_service import PesaPalService
+from models.lazy import LazyObject
 
 pesapal_blueprint = Blueprint('pesapal', __name__)
 
-pesapal_service = PesaPalService()
+
+def build_pesapal_service():
+    """
+    set PESAPAL_ASYNC=1 to serve these routes from the asyncio client.
+    the adapter keeps the same sync surface as PesaPalService
+    """
+    if os.getenv('PESAPAL_ASYNC') == '1':
+        from services.async_pesapal_service import SyncPesaPalAdapter
+        return SyncPesaPalAdapter()
+    return PesaPalService()
+
+
+"""
+clients && stores are built on first use, so importing
+this module never touches the network or the database
+"""
+pesapal_service = LazyObject(build_pesapal_service)
+idempotency = LazyObject(lambda: IdempotencyManager(
+        store_from_env(), ttl=int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))))
+
+payment_states = PaymentStateStore(
+        ttl=float(os.getenv('PESAPAL_STATE_TTL', 300)),
+        max_entries=int(os.getenv('PESAPAL_STATE_MAX_ENTRIES', 10000)))
+ipn_workers = IPNWorkerPool(pesapal_service, payment_states,
+        workers=int(os.getenv('PESAPAL_IPN_WORKERS', 4)),
+        max_queue=int(os.getenv('PESAPAL_IPN_QUEUE_SIZE', 10000)))
+
+
+def idempotent_response(key, call):
+    """
+    function definition that runs a payment call at most once per key.
+    clients can pick the key with an Idempotency-Key header, which is
+    required when key is None: calls whose body cannot tell a retry
+    from a new request of the same shape, like a second partial refund
+    of the same amount, must be keyed by the client
+    """
+    key = request.headers.get('Idempotency-Key') or key
+    if key is None:
+        return jsonify({'error': 'An Idempotency-Key header is required'}), 400
+    try:
+        response, replayed = idempotency.run(f"{request.endpoint}:{key}", call)
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(response), 200, {'Idempotent-Replayed': str(replayed).lower()}
+
 
 @pesapal_blueprint.route('/test')
 def test_route():
@@ -23,8 +72,9 @@ def initiate_payment():
         if not order_data or 'order_id' not in order_data:
             return jsonify({'error': 'Invalid order data'}), 400
 
-        response = pesapal_service.initiate_payment(order_data)
-        return jsonify(response), 200
+        return idempotent_response(
+                f"order:{order_data['order_id']}",
+                lambda: pesapal_service.initiate_payment(order_data))
     except ValueError as ve:
         logging.error(f"ValueError: {ve}")
         return jsonify({'error': str(ve)}), 400
@@ -35,6 +85,9 @@ def initiate_payment():
 
 @pesapal_blueprint.route('/pesapal/check-transaction-status/<transaction_id>', methods=['GET'])
 def check_transaction_status(transaction_id):
+    state = payment_states.get(transaction_id)
+    if state:
+        return jsonify(state['status']), 200
     try:
         response = pesapal_service.check_transaction_status(transaction_id)
         return jsonify(response), 200
@@ -58,7 +111,29 @@ def process_refund():
         payment_id = refund_data['payment_id']
         amount = refund_data['amount']
         reason = refund_data['reason']
-        response = pesapal_service.process_refund(payment_id, amount, reason)
-        return jsonify(response), 200
+        return idempotent_response(
+                None,
+                lambda: pesapal_service.process_refund(payment_id, amount, reason))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+@pesapal_blueprint.route('/pesapal/ipn', methods=['GET', 'POST'])
+def payment_notification():
+    """
+    IPN callback registered with Pesapal. it only validates and
+    enqueues the notification; the IPN workers fetch the status
+    """
+    notification = request.get_json(silent=True) or request.args.to_dict()
+    tracking_id = notification.get('OrderTrackingId')
+    ack = {
+            'orderNotificationType': notification.get('OrderNotificationType'),
+            'orderTrackingId': tracking_id,
+            'orderMerchantReference': notification.get('OrderMerchantReference'),
+            }
+
+    if not tracking_id:
+        return jsonify(dict(ack, status=500, error='OrderTrackingId is required')), 400
+    if not ipn_workers.submit(notification):
+        return jsonify(dict(ack, status=500)), 503
+    return jsonify(dict(ack, status=200)), 200
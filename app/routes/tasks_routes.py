@@ -12,6 +12,7 @@ from models.attachment import Attachment
 from models.notification import NotificationModel
 from models.audit_log import AuditLog
 from models.review import Review
+from models.geo_grid import sync_task
 from extensions import db
 
 tasks_bp = Blueprint('tasks', __name__)
@@ -39,10 +40,11 @@ def create_task():
         )
         db.session.add(new_task)
         db.session.commit()
-        return jsonify({'message': 'Task created successfully', 'task_id': new_task.id}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Error creating task: {str(e)}'}), 500
+    sync_task(db.session, new_task)
+    return jsonify({'message': 'Task created successfully', 'task_id': new_task.id}), 201
 
 @tasks_bp.route('/tasks/<int:task_id>/assign', methods=['POST'])
 def assign_task(task_id):
@@ -55,9 +57,10 @@ def assign_task(task_id):
 
     try:
         task.assign_tasker(db.session, tasker_id)
-        return jsonify({'message': 'Tasker assigned successfully'}), 200
     except Exception as e:
         return jsonify({'error': f'Error assigning tasker: {str(e)}'}), 500
+    sync_task(db.session, task)
+    return jsonify({'message': 'Tasker assigned successfully'}), 200
 
 @tasks_bp.route('/tasks/<int:task_id>/status', methods=['PUT'])
 def update_task_status(task_id):
@@ -70,9 +73,10 @@ def update_task_status(task_id):
 
     try:
         task.change_status(db.session, TaskStatusEnum(new_status))
-        return jsonify({'message': 'Task status updated successfully'}), 200
     except Exception as e:
         return jsonify({'error': f'Error updating task status: {str(e)}'}), 500
+    sync_task(db.session, task)
+    return jsonify({'message': 'Task status updated successfully'}), 200
 
 @tasks_bp.route('/tasks/<int:task_id>/cancel', methods=['PUT'])
 def cancel_task(task_id):
@@ -82,9 +86,10 @@ def cancel_task(task_id):
 
     try:
         task.cancel_task(db.session)
-        return jsonify({'message': 'Task canceled successfully'}), 200
     except Exception as e:
         return jsonify({'error': f'Error canceling task: {str(e)}'}), 500
+    sync_task(db.session, task)
+    return jsonify({'message': 'Task canceled successfully'}), 200
 
 @tasks_bp.route('/tasks/<int:task_id>/attachments', methods=['POST'])
 def add_attachment(task_id):
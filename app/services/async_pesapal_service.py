@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""
+asyncio variant of the pesapal service, so that one worker
+can keep hundreds of payment calls in flight at once
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+from urllib.parse import urlsplit
+import aiohttp
+from services.http_client import (CircuitOpenError, DEFAULT_POOL_SIZE,
+        IDEMPOTENT_METHODS, RETRY_STATUS_CODES)
+from services.pesapal_service import PESAPAL_API_URL, http_client, token_cache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPesaPalService:
+    """
+    class definition for the asyncio-native pesapal service.
+    it shares the process-wide token cache and the per-host circuit
+    breakers of PesaPalService's http client, and retries the same way,
+    so a host tripped by one client fails fast in the other too
+    """
+    def __init__(self, limit: int = 500, limit_per_host: int = DEFAULT_POOL_SIZE,
+            connect_timeout: float = 3.05, read_timeout: float = 15.0,
+            max_retries: int = 3, backoff_base: float = 0.2,
+            backoff_cap: float = 5.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._session = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        method definition that builds the service from PESAPAL_* env settings
+        """
+        return cls(
+                limit=int(os.getenv('PESAPAL_ASYNC_LIMIT', 500)),
+                limit_per_host=int(os.getenv('PESAPAL_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                connect_timeout=float(os.getenv('PESAPAL_CONNECT_TIMEOUT', 3.05)),
+                read_timeout=float(os.getenv('PESAPAL_READ_TIMEOUT', 15)),
+                max_retries=int(os.getenv('PESAPAL_MAX_RETRIES', 3)),
+                )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        method definition that creates the session lazily,
+        since it has to be bound to the running event loop
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                    limit_per_host=self.limit_per_host, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def get_access_token(self) -> str:
+        """
+        method definition that returns the cached access token.
+        only a cache miss is handed off to a thread
+        """
+        token = token_cache.peek()
+        if token:
+            return token
+        return await asyncio.to_thread(token_cache.get_token)
+
+    async def _send(self, method: str, url: str, headers: dict,
+            idempotent: bool = None, **kwargs) -> dict:
+        """
+        method definition that sends an authorised request and
+        returns the decoded json body. only idempotent calls are
+        retried and a 401 refreshes the token once
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = self.max_retries + 1 if idempotent else 1
+        breaker = http_client.breaker(url)
+        session = self._get_session()
+        refreshed = False
+        attempt = 0
+
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+            token = await self.get_access_token()
+            headers['Authorization'] = f'Bearer {token}'
+            last_attempt = attempt == attempts - 1
+            settled = False
+            try:
+                async with session.request(method, url, headers=headers, **kwargs) as response:
+                    if response.status >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    settled = True
+
+                    if response.status == 401 and not refreshed:
+                        token_cache.invalidate(token)
+                        refreshed = True
+                        continue
+                    if last_attempt or response.status not in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    logger.warning(f"{method} {url} returned {response.status}, retrying")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                breaker.record_failure()
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {url} failed ({e}), retrying")
+            except aiohttp.ClientError:
+                if not settled:
+                    breaker.record_failure()
+                raise
+            except BaseException:
+                if not settled:
+                    breaker.release()
+                raise
+
+            await asyncio.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
+            attempt += 1
+
+    async def initiate_payment(self, order_data: dict) -> dict:
+        """
+        method definition that initials a payment
+        """
+        url = f"{PESAPAL_API_URL}/PostPesapalDirectOrderv4"
+        headers = {
+                'Content-Type': 'application/json'
+                }
+
+        try:
+            return await self._send('POST', url, headers, json=order_data)
+        except aiohttp.ClientError as e:
+            logger.error(f"Error initiating payment: {e}")
+            raise e
+
+    async def check_transaction_status(self, transaction_id: str) -> dict:
+        """
+        method definition to check the status of a transaction
+        """
+        url = f"{PESAPAL_API_URL}/CheckTransactionStatus/{transaction_id}"
+
+        try:
+            return await self._send('GET', url, {})
+        except aiohttp.ClientError as e:
+            logger.error(f"Error checking transaction status: {e}")
+            raise e
+
+    async def confirm_payment(self, transaction_id) -> dict:
+        """
+        method definition to confirm whether a payment went through
+        """
+        url = f"{PESAPAL_API_URL}/ConfirmPayment/{transaction_id}"
+
+        try:
+            return await self._send('GET', url, {})
+        except aiohttp.ClientError as e:
+            logger.error(f"Error confirming payment: {e}")
+            raise e
+
+    async def process_refund(self, payment_id: str, amount: float, reason: str) -> dict:
+        """
+        method definition to process a refund
+        """
+        url = f"{PESAPAL_API_URL}/RefundPayment"
+        headers = {
+                'Content-Type': 'application/json'
+                }
+        data = {
+                'payment_id': payment_id,
+                'amount': amount,
+                'reason': reason
+                }
+
+        try:
+            return await self._send('POST', url, headers, json=data)
+        except aiohttp.ClientError as e:
+            logger.error(f"Error processing refund for payment {payment_id}: {e}")
+            raise e
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class SyncPesaPalAdapter:
+    """
+    class definition that exposes an AsyncPesaPalService to sync code.
+    every call is scheduled on one event loop running in a background
+    thread, so all flask worker threads share the same connections
+    """
+    def __init__(self, service: AsyncPesaPalService = None, timeout: float = 60.0):
+        self.service = service or AsyncPesaPalService.from_env()
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                name='pesapal-event-loop', daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return future.result(self.timeout)
+
+    def initiate_payment(self, order_data: dict) -> dict:
+        return self._run(self.service.initiate_payment(order_data))
+
+    def check_transaction_status(self, transaction_id: str) -> dict:
+        return self._run(self.service.check_transaction_status(transaction_id))
+
+    def confirm_payment(self, transaction_id) -> dict:
+        return self._run(self.service.confirm_payment(transaction_id))
+
+    def process_refund(self, payment_id: str, amount: float, reason: str) -> dict:
+        return self._run(self.service.process_refund(payment_id, amount, reason))
+
+    def close(self):
+        """
+        method definition that closes the session and stops the loop
+        """
+        self._run(self.service.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+"""
+database helpers shared by the payment services
+"""
+import os
+from upserts import upsert as upsert_rows
+
+
+def database_url() -> str:
+    """
+    function definition for the SQLAlchemy url of the MAIN_DB_* database
+    """
+    return (f"{os.getenv('MAIN_DB_DRIVER')}://{os.getenv('MAIN_DB_USER')}:"
+            f"{os.getenv('MAIN_DB_USER_PASSWORD')}@{os.getenv('MAIN_DB_HOST')}:"
+            f"{os.getenv('MAIN_DB_PORT')}/{os.getenv('MAIN_DB')}")
+
+
+def upsert(connection, table, rows: list, keys: list, update: list):
+    """
+    function definition for a multi-row insert that overwrites
+    the `update` columns of rows whose `keys` already exist
+    """
+    return upsert_rows(connection, table, rows, keys,
+            lambda new: {column: new[column] for column in update})
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+pooled HTTP client used for all calls to the Pesapal API
+"""
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+DEFAULT_POOL_SIZE = 20
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    raised instead of calling a host whose circuit is open
+    """
+
+
+class CircuitBreaker:
+    """
+    class definition for a circuit breaker that fails fast
+    once a host keeps failing
+        *closed -> calls go through
+        *open -> calls fail immediately until reset_timeout passes
+        *half_open -> one trial call decides whether to close again
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """
+        method definition that decides whether a call may go out
+        """
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """
+        method definition that frees the half-open trial slot
+        when a call ended without telling us anything about the host
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class PesaPalHttpClient:
+    """
+    class definition for a keep-alive HTTP client with
+    connection pooling, timeouts, jittered retries for idempotent
+    calls and a circuit breaker per host
+    """
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, connect_timeout: float = 3.05,
+            read_timeout: float = 15.0, max_retries: int = 3,
+            backoff_base: float = 0.2, backoff_cap: float = 5.0,
+            failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls):
+        """
+        method definition that builds a client from PESAPAL_* env settings
+        """
+        return cls(
+                pool_size=int(os.getenv('PESAPAL_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                connect_timeout=float(os.getenv('PESAPAL_CONNECT_TIMEOUT', 3.05)),
+                read_timeout=float(os.getenv('PESAPAL_READ_TIMEOUT', 15)),
+                max_retries=int(os.getenv('PESAPAL_MAX_RETRIES', 3)),
+                failure_threshold=int(os.getenv('PESAPAL_BREAKER_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv('PESAPAL_BREAKER_RESET', 30)),
+                )
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """
+        method definition that returns the circuit breaker for a url's host
+        """
+        host = urlsplit(url).netloc
+        with self._breakers_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def backoff(self, attempt: int) -> float:
+        """
+        method definition for the "full jitter" backoff delay of an attempt
+        """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def request(self, method: str, url: str, idempotent: bool = None, **kwargs):
+        """
+        method definition that sends a request through the pool.
+        only idempotent calls are retried, since retrying a payment
+        or refund could charge the customer twice
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = self.max_retries + 1 if idempotent else 1
+        kwargs.setdefault('timeout', self.timeout)
+        breaker = self.breaker(url)
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record_failure()
+                if last_attempt:
+                    raise
+                logger.warning(f"{method} {url} failed ({e}), retrying")
+            except requests.RequestException:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if last_attempt or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying")
+
+            time.sleep(self.backoff(attempt))
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+"""
+idempotency layer for payment initiation && refunds, so that
+client retries never turn into duplicate upstream calls
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import (Column, Float, MetaData, String, Table, Text,
+        create_engine, delete, insert, select, update)
+from sqlalchemy.exc import IntegrityError
+from services.database import database_url, upsert
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """
+    raised when another worker still holds the key after we waited for it
+    """
+
+
+class MemoryIdempotencyStore:
+    """
+    class definition for the default in-process store,
+    an LRU of cached responses with per-entry expiry
+    """
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def set(self, key: str, response, ttl: float):
+        with self._lock:
+            self._entries[key] = (response, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def claim(self, key: str, lease: float) -> bool:
+        """
+        method definition for claiming a key. one process owns the
+        whole store and the manager already coalesces within it
+        """
+        return True
+
+    def wait(self, key: str, timeout: float):
+        return self.get(key)
+
+    def release(self, key: str):
+        pass
+
+
+class DatabaseIdempotencyStore:
+    """
+    class definition for a store backed by an `idempotency_keys` table,
+    which lets every worker process see the same cached responses.
+    a worker claims a key by inserting it with an empty response before
+    calling upstream; the primary key makes exactly one insert win, and
+    the claim expires after `lease` seconds if its worker dies
+    """
+    def __init__(self, engine, table_name: str = 'idempotency_keys', poll_interval: float = 0.2):
+        self.engine = create_engine(engine) if isinstance(engine, str) else engine
+        self.poll_interval = poll_interval
+        metadata = MetaData()
+        self.table = Table(
+                table_name, metadata,
+                Column('key', String(255), primary_key=True),
+                Column('response', Text, nullable=False),
+                Column('expires_at', Float, nullable=False, index=True),
+                )
+        metadata.create_all(self.engine)
+
+    def _entry(self, key: str):
+        query = select(self.table.c.response, self.table.c.expires_at).where(self.table.c.key == key)
+        with self.engine.connect() as connection:
+            return connection.execute(query).first()
+
+    def get(self, key: str):
+        entry = self._entry(key)
+        if entry is None or not entry.response or entry.expires_at <= time.time():
+            return None
+        return json.loads(entry.response)
+
+    def set(self, key: str, response, ttl: float):
+        row = {'key': key, 'response': json.dumps(response), 'expires_at': time.time() + ttl}
+        with self.engine.begin() as connection:
+            upsert(connection, self.table, [row], ['key'], ['response', 'expires_at'])
+
+    def claim(self, key: str, lease: float) -> bool:
+        """
+        method definition that tries to become the one worker calling
+        upstream for key. an expired entry, finished or abandoned,
+        is taken over with a conditional update
+        """
+        now = time.time()
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(self.table), {'key': key, 'response': '', 'expires_at': now + lease})
+            return True
+        except IntegrityError:
+            pass
+
+        with self.engine.begin() as connection:
+            result = connection.execute(update(self.table)
+                    .where(self.table.c.key == key, self.table.c.expires_at <= now)
+                    .values(response='', expires_at=now + lease))
+        return result.rowcount == 1
+
+    def wait(self, key: str, timeout: float):
+        """
+        method definition that polls a key claimed by another worker.
+        returns its response, or None once the claim is released,
+        expires or `timeout` passes
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = self._entry(key)
+            if entry is None or entry.expires_at <= time.time():
+                return None
+            if entry.response:
+                return json.loads(entry.response)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, key: str):
+        """
+        method definition that drops our claim after the upstream
+        call failed, so a retry can claim the key again
+        """
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.table).where(
+                self.table.c.key == key, self.table.c.response == ''))
+
+    def purge_expired(self) -> int:
+        """
+        method definition that deletes expired keys and returns how many
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(delete(self.table).where(self.table.c.expires_at <= time.time()))
+        return result.rowcount
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class IdempotencyManager:
+    """
+    class definition that returns cached responses for repeated keys
+    and coalesces concurrent duplicates into a single upstream call.
+    threads of one process wait on each other in memory; processes
+    sharing the DB store claim the key there first, and the losers
+    wait up to `wait_timeout` seconds for the winner's response.
+    `lease` must outlive the slowest upstream call
+    """
+    def __init__(self, store=None, ttl: float = 24 * 3600,
+            lease: float = 120.0, wait_timeout: float = 30.0):
+        self.store = store or MemoryIdempotencyStore()
+        self.ttl = ttl
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, call) -> tuple:
+        """
+        method definition that returns (response, replayed).
+        `call` only runs if no response is cached or in flight for key
+        """
+        response = self.store.get(key)
+        if response is not None:
+            return response, True
+
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.response, True
+
+        try:
+            response, replayed = self._run_once(key, call)
+            in_flight.response = response
+            return response, replayed
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+
+    def _run_once(self, key: str, call) -> tuple:
+        """
+        method definition for the leader of a key in this process:
+        replay a stored response, or claim the key across processes
+        and make the upstream call
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            response = self.store.get(key)
+            if response is not None:
+                return response, True
+            if self.store.claim(key, self.lease):
+                break
+            response = self.store.wait(key, max(deadline - time.monotonic(), 0))
+            if response is not None:
+                return response, True
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict(f"A request with idempotency key {key} is still in progress")
+
+        try:
+            response = call()
+        except Exception:
+            self.store.release(key)
+            raise
+        self.store.set(key, response, self.ttl)
+        return response, False
+
+
+def store_from_env():
+    """
+    function definition that picks the store named by IDEMPOTENCY_STORE,
+    either 'memory' (default) or 'db' using the MAIN_DB_* settings
+    """
+    if os.getenv('IDEMPOTENCY_STORE', 'memory') != 'db':
+        return MemoryIdempotencyStore(int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000)))
+    return DatabaseIdempotencyStore(database_url())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+queue && worker pool for Pesapal IPN (instant payment notification)
+callbacks, so payment state is pushed to us instead of polled
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentStateStore:
+    """
+    class definition for the latest known state of each payment,
+    keyed by Pesapal's OrderTrackingId. it is an in-process LRU:
+    a state is served for `ttl` seconds after its IPN, then callers
+    fall back to asking Pesapal, and at most `max_entries` are kept
+    """
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tracking_id: str):
+        with self._lock:
+            state = self._states.get(tracking_id)
+            if state is None:
+                return None
+            if state['updated_at'] + self.ttl <= time.time():
+                del self._states[tracking_id]
+                return None
+            self._states.move_to_end(tracking_id)
+            return state
+
+    def update(self, tracking_id: str, state: dict):
+        with self._lock:
+            self._states[tracking_id] = dict(state, updated_at=time.time())
+            self._states.move_to_end(tracking_id)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+
+class IPNWorkerPool:
+    """
+    class definition for a bounded notification queue drained by
+    worker threads. each worker asks Pesapal for the transaction
+    status once and records it in the payment state store
+    """
+    def __init__(self, service, state_store: PaymentStateStore,
+            workers: int = 4, max_queue: int = 10000):
+        self.service = service
+        self.state_store = state_store
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'ipn-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, notification: dict) -> bool:
+        """
+        method definition that enqueues a notification without blocking.
+        returns False when the queue is full so Pesapal retries later
+        """
+        self.start()
+        tracking_id = notification['OrderTrackingId']
+        with self._lock:
+            if tracking_id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(notification)
+            except queue.Full:
+                logger.error(f"IPN queue full, rejecting notification for {tracking_id}")
+                return False
+            self._queued.add(tracking_id)
+        return True
+
+    def _work(self):
+        while True:
+            notification = self._queue.get()
+            if notification is None:
+                self._queue.task_done()
+                return
+            tracking_id = notification['OrderTrackingId']
+            with self._lock:
+                self._queued.discard(tracking_id)
+            try:
+                status = self.service.check_transaction_status(tracking_id)
+                self.state_store.update(tracking_id, {
+                    'merchant_reference': notification.get('OrderMerchantReference'),
+                    'notification_type': notification.get('OrderNotificationType'),
+                    'status': status,
+                    })
+            except Exception as e:
+                logger.error(f"Failed to process IPN for {tracking_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stop(self):
+        """
+        method definition that drains the queue and stops the workers
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
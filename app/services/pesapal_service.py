@@ -8,10 +8,28 @@ import os
 import requests
 import subprocess
 import logging
+import time
+from datetime import datetime, timezone
+from services.http_client import PesaPalHttpClient
+from services.token_cache import TokenCache
 
 
 PESAPAL_CONSUMER_KEY = os.getenv('PESAPAL_CONSUMER_KEY')
 PESAPAL_CONSUMER_SECRET = os.getenv('PESAPAL_CONSUMER_SECRET')
+PESAPAL_TOKEN_URL = os.getenv('PESAPAL_TOKEN_URL', "https://cybqa.pesapal.com/pesapalv3/api/Auth/RequestToken")
+PESAPAL_API_URL = os.getenv('PESAPAL_API_URL', "https://www.pesapal.com/API").rstrip('/')
+
+"""
+Pesapal tokens are valid for 5 minutes.
+this is used when the response carries no usable expiryDate
+"""
+DEFAULT_TOKEN_TTL = 300
+
+"""
+one pooled, keep-alive client for the whole process.
+point PESAPAL_TOKEN_URL/PESAPAL_API_URL at a local stub server to test
+"""
+http_client = PesaPalHttpClient.from_env()
 
 """
 configuring the logging aspect of the integration
@@ -24,71 +42,104 @@ logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %
 logger = logging.getLogger(__name__)
 
 
-class PesaPalService:
+def request_access_token() -> tuple:
     """
-    this is the class definition containing
-    all the relevant methods && attributes
+    function definition that fetches a fresh OAuth access token
+    from Pesapal and returns it together with its expiry timestamp
     """
-    def __init__(self):
-        self.access_token = self.get_access_token()
+    headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            }
 
-    def get_access_token(self) -> str:
-        """
-        method definition that fetches
-        the OAuth access token from Pesapal
-        """
-        url = "https://cybqa.pesapal.com/pesapalv3/api/Auth/RequestToken"
+    credentials = {
+            "consumer_key": f"{PESAPAL_CONSUMER_KEY}",
+            "consumer_secret": f"{PESAPAL_CONSUMER_SECRET}"
+            }
 
-        headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                }
+    try:
+        response = http_client.request('POST', PESAPAL_TOKEN_URL, idempotent=True,
+                headers=headers, json=credentials)
+        response.raise_for_status()
 
-        print(f"Response Status Code: {PESAPAL_CONSUMER_KEY}")
-        print(f"Response Content: {PESAPAL_CONSUMER_SECRET}")
+        token_data = response.json()
+        if not token_data.get('token'):
+            logging.error(f"Error retrieving access token: {token_data}")
+            raise KeyError('Access token not found in response')
 
-        credentials = {
-                "consumer_key": f"{PESAPAL_CONSUMER_KEY}",
-                "consumer_secret": f"{PESAPAL_CONSUMER_SECRET}"
-                }
+        return token_data['token'], _token_expiry(token_data.get('expiryDate'))
 
-        try:
-            response = requests.post(url, headers=headers, json=credentials)
-            response.raise_for_status()
+    except requests.RequestException as e:
+        logging.error(f"HTTP error: {e}")
+        raise e
 
-            token_data = response.json()
-            logging.info(f"Response from pesapal: {token_data}")
-            logging.info(f"Response Status Code: {PESAPAL_CONSUMER_KEY}")
-            logging.info(f"Response Content: {PESAPAL_CONSUMER_KEY}")
-            if 'token' in token_data:
-                return token_data['access_token']
-            else:
-                logging.error(f"Error retrieving access token: {token_data}")
-                raise KeyError('Access token not found in response')
 
-            return token_data['token']
+def _token_expiry(expiry_date) -> float:
+    """
+    function definition that converts Pesapal's expiryDate
+    into a time.time() timestamp. Pesapal sends UTC, so a
+    value without an offset is read as UTC, not local time
+    """
+    try:
+        expires = datetime.fromisoformat(expiry_date)
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        return expires.timestamp()
+    except (TypeError, ValueError):
+        return time.time() + DEFAULT_TOKEN_TTL
 
-        except requests.RequestException as e:
-            logging.error(f"HTTP error: {e}")
-            raise e
 
-        except KeyError as e:
-            logging.error(f"Key error: {e}")
+"""
+the token cache is shared by every PesaPalService in the process
+so that workers never stampede the Auth/RequestToken endpoint
+"""
+token_cache = TokenCache(request_access_token)
+
 
+class PesaPalService:
+    """
+    this is the class definition containing
+    all the relevant methods && attributes
+    """
+    @property
+    def access_token(self) -> str:
+        return self.get_access_token()
+
+    def get_access_token(self) -> str:
+        """
+        method definition that returns the cached
+        OAuth access token, fetching it on first use
+        """
+        return token_cache.get_token()
+
+    def _send(self, method: str, url: str, headers: dict, **kwargs):
+        """
+        method definition that sends an authorised request.
+        a 401 means the cached token was revoked early,
+        so it is dropped and the request is retried once
+        """
+        for attempt in range(2):
+            token = self.get_access_token()
+            headers['Authorization'] = f'Bearer {token}'
+            response = http_client.request(method, url, headers=headers, **kwargs)
+            if response.status_code != 401 or attempt:
+                break
+            token_cache.invalidate(token)
+
+        response.raise_for_status()
+        return response
 
     def initiate_payment(self, order_data: dict) -> dict:
         """
         method definition that initials a payment
         """
-        url = "https://www.pesapal.com/API/PostPesapalDirectOrderv4"
+        url = f"{PESAPAL_API_URL}/PostPesapalDirectOrderv4"
         headers = {
-                'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json'
                 }
 
         try:
-            response = requests.post(url, headers=headers, json=order_data)
-            response.raise_for_status()
+            response = self._send('POST', url, headers, json=order_data)
             return response.json()
 
         except requests.RequestException as e:
@@ -99,14 +150,10 @@ class PesaPalService:
             """
             method definition to check the status of a transaction
             """
-            url = f"https://www.pesapal.com/API/CheckTransactionStatus/{transaction_id}"
-            headers = {
-                'Authorization': f'Bearer {self.access_token}'
-                }
+            url = f"{PESAPAL_API_URL}/CheckTransactionStatus/{transaction_id}"
 
             try:
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
+                response = self._send('GET', url, {})
                 return response.json()
 
             except requests.RequestException as e:
@@ -117,14 +164,10 @@ class PesaPalService:
         """
         method definition to confirm whether a payment went through
         """
-        url = f"https://www.pesapal.com/API/ConfirmPayment/{transaction_id}"
-        headers = {
-                'Authorization': f'Bearer {self.access_token}'
-                }
+        url = f"{PESAPAL_API_URL}/ConfirmPayment/{transaction_id}"
 
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            response = self._send('GET', url, {})
             return response.json()
         
         except requests.RequestException as e:
@@ -135,9 +178,8 @@ class PesaPalService:
         """
         method definition to process a refund
         """
-        url = "https://www.pesapal.com/API/RefundPayment"
+        url = f"{PESAPAL_API_URL}/RefundPayment"
         headers = {
-                'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json'
                 }
         data = {
@@ -147,8 +189,7 @@ class PesaPalService:
                 }
 
         try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
+            response = self._send('POST', url, headers, json=data)
             return response.json()
 
         except requests.RequestException as e:
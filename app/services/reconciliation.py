@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""
+batched reconciliation of pending Pesapal transactions.
+
+usage:
+    python -m services.reconciliation pending_ids.txt --concurrency 20 --rate 10
+    python -m services.reconciliation pending_ids.txt --output results.ndjson
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine
+from services.async_pesapal_service import AsyncPesaPalService
+from services.database import database_url, upsert
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    class definition for a token bucket that allows
+    `rate` calls per second with bursts of up to `burst`
+    """
+    def __init__(self, rate: float, burst: int = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """
+    function definition for the nearest-rank percentile of sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class DatabaseResultWriter:
+    """
+    class definition for the default bulk writer, which upserts each
+    batch of results into a `transaction_statuses` table keyed by
+    transaction id, so a re-run overwrites instead of duplicating
+    """
+    def __init__(self, engine, table_name: str = 'transaction_statuses', chunk_size: int = 500):
+        self.engine = create_engine(engine) if isinstance(engine, str) else engine
+        self.chunk_size = chunk_size
+        metadata = MetaData()
+        self.table = Table(
+                table_name, metadata,
+                Column('transaction_id', String(255), primary_key=True),
+                Column('payment_status', String(64), nullable=True, index=True),
+                Column('response', Text, nullable=False),
+                Column('reconciled_at', Float, nullable=False),
+                )
+        metadata.create_all(self.engine)
+
+    def __call__(self, results: list):
+        now = time.time()
+        rows = [{
+            'transaction_id': result['transaction_id'],
+            'payment_status': (result['status'].get('payment_status_description')
+                if isinstance(result['status'], dict) else None),
+            'response': json.dumps(result['status']),
+            'reconciled_at': now,
+            } for result in results]
+        with self.engine.begin() as connection:
+            for i in range(0, len(rows), self.chunk_size):
+                upsert(connection, self.table, rows[i:i + self.chunk_size], ['transaction_id'],
+                        ['payment_status', 'response', 'reconciled_at'])
+
+
+class ResultFileWriter:
+    """
+    class definition for a bulk writer that appends
+    each batch of results to an NDJSON file
+    """
+    def __init__(self, path: str = 'reconciliation_results.ndjson'):
+        self.path = path
+
+    def __call__(self, results: list):
+        with open(self.path, 'a') as results_file:
+            results_file.writelines(json.dumps(result) + '\n' for result in results)
+
+
+class ReconciliationJob:
+    """
+    class definition for a resumable reconciliation run
+        *concurrency -> max status checks in flight at once
+        *rate -> max status checks started per second
+        *write_results -> callable that persists a batch of results,
+                          DatabaseResultWriter on MAIN_DB_* by default
+        *checkpoint_path -> file listing transaction ids already written
+    """
+    def __init__(self, service: AsyncPesaPalService = None, concurrency: int = 20,
+            rate: float = 10.0, write_results=None, batch_size: int = 500,
+            checkpoint_path: str = 'reconciliation.checkpoint'):
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.service = service or AsyncPesaPalService.from_env()
+        self.concurrency = concurrency
+        self.rate = rate
+        self.write_results = write_results or DatabaseResultWriter(database_url())
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self._flush_lock = threading.Lock()
+
+    def load_checkpoint(self) -> set:
+        """
+        method definition that returns the ids finished by earlier runs
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as checkpoint:
+            return {line.strip() for line in checkpoint if line.strip()}
+
+    def _flush(self, batch: list):
+        """
+        method definition that writes a batch back and only then
+        checkpoints it, so an interrupted run redoes at most one batch.
+        it blocks on the database && fsync, so run() calls it in a thread
+        """
+        if not batch:
+            return
+        with self._flush_lock:
+            self.write_results(batch)
+            with open(self.checkpoint_path, 'a') as checkpoint:
+                checkpoint.writelines(f"{result['transaction_id']}\n" for result in batch)
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+    async def _flush_pending(self, pending: list):
+        batch = pending[:]
+        pending.clear()
+        await asyncio.to_thread(self._flush, batch)
+
+    async def run(self, transaction_ids) -> dict:
+        """
+        method definition that reconciles every id not yet checkpointed
+        and returns a throughput && latency report
+        """
+        done = self.load_checkpoint()
+        requested = list(dict.fromkeys(str(t) for t in transaction_ids))
+        todo = [transaction_id for transaction_id in requested if transaction_id not in done]
+        queue = asyncio.Queue()
+        for transaction_id in todo:
+            queue.put_nowait(transaction_id)
+
+        limiter = RateLimiter(self.rate)
+        latencies = []
+        pending = []
+        failed = []
+
+        async def worker():
+            while True:
+                try:
+                    transaction_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    status = await self.service.check_transaction_status(transaction_id)
+                except Exception as e:
+                    logger.error(f"Failed to reconcile transaction {transaction_id}: {e}")
+                    failed.append(transaction_id)
+                    continue
+                finally:
+                    latencies.append(time.perf_counter() - started)
+
+                pending.append({'transaction_id': transaction_id, 'status': status})
+                if len(pending) >= self.batch_size:
+                    await self._flush_pending(pending)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(todo)) or 1)))
+        finally:
+            await self._flush_pending(pending)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        reconciled = len(todo) - len(failed)
+        return {
+                'reconciled': reconciled,
+                'failed': len(failed),
+                'skipped': len(requested) - len(todo),
+                'elapsed_seconds': round(elapsed, 3),
+                'throughput_per_second': round(reconciled / elapsed, 2) if elapsed else 0.0,
+                'latency_ms': {
+                    'p50': round(percentile(latencies, 50) * 1000, 2),
+                    'p95': round(percentile(latencies, 95) * 1000, 2),
+                    'p99': round(percentile(latencies, 99) * 1000, 2),
+                    },
+                }
+
+
+async def _main(args):
+    with open(args.ids_file) as ids_file:
+        transaction_ids = [line.strip() for line in ids_file if line.strip()]
+    job = ReconciliationJob(concurrency=args.concurrency, rate=args.rate,
+            write_results=ResultFileWriter(args.output) if args.output else None,
+            batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint)
+    try:
+        return await job.run(transaction_ids)
+    finally:
+        await job.service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reconcile pending Pesapal transactions')
+    parser.add_argument('ids_file', help='file with one transaction id per line')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=10.0, help='status checks per second')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--checkpoint', default='reconciliation.checkpoint')
+    parser.add_argument('--output', help='write results to this NDJSON file instead of the database')
+    print(json.dumps(asyncio.run(_main(parser.parse_args())), indent=4))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+process-wide cache for the Pesapal OAuth access token
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """
+    class definition for a cached access token that tracks its expiry,
+    refreshes ahead of time in the background and makes sure only
+    one request to the token endpoint is ever in flight
+        *fetch_token -> callable returning (token, expires_at) where
+                        expires_at is a time.time() timestamp
+        *refresh_margin -> seconds before expiry at which we refresh
+        *min_refresh_delay -> shortest time between two refreshes ahead of
+                              expiry, for tokens that live less than the margin
+    """
+    def __init__(self, fetch_token, refresh_margin: float = 60.0, min_refresh_delay: float = 5.0):
+        self._fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.min_refresh_delay = min_refresh_delay
+        self._condition = threading.Condition()
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._in_flight = False
+        self._timer = None
+
+    def peek(self):
+        """
+        method definition that returns the cached token
+        without blocking, or None if there is no usable token
+        """
+        with self._condition:
+            if self._token and time.time() < self._expires_at:
+                return self._token
+            return None
+
+    def get_token(self) -> str:
+        """
+        method definition that returns a valid access token,
+        fetching one only when the cache is empty or expired
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._token and now < self._expires_at:
+                    if now >= self._refresh_at:
+                        self._refresh_in_background()
+                    return self._token
+                if not self._in_flight:
+                    self._in_flight = True
+                    break
+                self._condition.wait()
+
+        return self._refresh()
+
+    def invalidate(self, token: str = None):
+        """
+        method definition that drops the cached token,
+        e.g after Pesapal rejected it with a 401.
+        passing the rejected token avoids dropping a newer one
+        """
+        with self._condition:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _refresh(self) -> str:
+        """
+        method definition that calls the token endpoint.
+        callers must have claimed the in-flight slot
+        """
+        try:
+            token, expires_at = self._fetch_token()
+        except Exception:
+            with self._condition:
+                self._in_flight = False
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            self._token = token
+            self._expires_at = expires_at
+            self._in_flight = False
+            self._condition.notify_all()
+            self._schedule_refresh()
+        return token
+
+    def _refresh_in_background(self):
+        """
+        method definition that starts a background refresh
+        unless one is already running. expects the lock to be held
+        """
+        if self._in_flight:
+            return
+        self._in_flight = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            logger.error(f"Background token refresh failed: {e}")
+
+    def _schedule_refresh(self):
+        """
+        method definition that arms a timer to refresh the token
+        shortly before it expires, but never sooner than min_refresh_delay
+        so a short-lived token cannot refresh in a tight loop.
+        expects the lock to be held
+        """
+        if self._timer:
+            self._timer.cancel()
+        now = time.time()
+        self._refresh_at = max(self._expires_at - self.refresh_margin, now + self.min_refresh_delay)
+        delay = self._refresh_at - now
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._condition:
+            self._refresh_in_background()
@@ -2,28 +2,102 @@
 
 """
 this be the analytics model for our platform
+
+usage:
+    python analytics.py replay-dead-letters
 """
-import logging
+import argparse
+import base64
 import json
-import csv
+import logging
 import pytz
-from datetime import datetime
-from sqlalchemy import JSON, String, Enum, Integer, Float
+from datetime import datetime, timedelta
+from sqlalchemy import (JSON, String, Enum, Integer, Float, Column,
+        DateTime, ForeignKey, Index, and_, func, insert, or_)
 from sqlalchemy.exc import SQLAlchemyError
 from storage import Storage
+from lazy import LazyObject
+from analytics_buffer import BufferFullError, MetricBuffer
+from analytics_cache import TrendCache, TrendCacheVersion
+from analytics_engine import MetricWindow, TrendEngine, bucket_count, parse_bucket
+from analytics_rollup import AnalyticsRollup
+from sessions import background_session
+from streaming import EXPORT_FORMATS, byte_chunks, encode_rows, keyset_pages, started
+from user import Base
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
-storage = Storage()
+storage = LazyObject(Storage)
+
+EXPORT_FIELDS = [
+        'analytics_id', 'user_id', 'task_id', 'metric_type',
+        'metric_value', 'timestamp', 'report_data'
+        ]
+
+
+def start_metric_buffer() -> MetricBuffer:
+    """
+    function definition for the metric buffer. its flusher thread
+    writes through a session of its own
+    """
+    session = background_session(storage)
+    return MetricBuffer(lambda rows: Analytics.insert_rows(rows, session)).start()
+
 
+"""
+metrics posted to the API are buffered and written in batches
+by a background flusher, see Analytics.buffer_metrics
+"""
+metric_buffer = LazyObject(start_metric_buffer)
+
+"""
+trend results served to dashboards, invalidated whenever
+any process writes metrics of a type they cover: at once for
+writes made here, within a second for those of other workers
+"""
+trend_cache = TrendCache(
+        version_of=lambda metric_type: TrendCacheVersion.current(storage.session, metric_type))
 
-class Analytics():
+MAX_PERIOD_DAYS = 3660
+
+
+def period_bounds(time_period):
+    """
+    function definition that turns an 'Nd' period into (start, end)
+    """
+    if time_period.endswith('d') and time_period[:-1].isdigit():
+        days = int(time_period[:-1])
+        if days > MAX_PERIOD_DAYS:
+            raise ValueError(f"time_period can be at most {MAX_PERIOD_DAYS}d.")
+        end_date = datetime.now(pytz.timezone('Africa/Nairobi')).replace(tzinfo=None)
+        return end_date - timedelta(days=days), end_date
+    raise ValueError("Unsupported time period format.")
+
+
+def statistics_window(time_period, bucket) -> tuple:
+    """
+    function definition for the (start, end, bucket_seconds) of a
+    statistics request. raises ValueError for a bad period or bucket,
+    or a window with more buckets than the engine allows
+    """
+    start_date, end_date = period_bounds(time_period)
+    bucket_seconds = parse_bucket(bucket)
+    bucket_count(start_date.timestamp(), end_date.timestamp(), bucket_seconds)
+    return start_date, end_date, bucket_seconds
+
+
+class Analytics(Base):
     """
     class definition for the analytics
     for different metrics in our platform
     """
     __tablename__ = 'analytics'
+    __table_args__ = (
+            Index('ix_analytics_user_type_time', 'user_id', 'metric_type', 'timestamp'),
+            Index('ix_analytics_type_time', 'metric_type', 'timestamp'),
+            Index('ix_analytics_time', 'timestamp'),
+            )
 
     analytics_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=True)
@@ -38,9 +112,42 @@ class Analytics():
         method definition to record a new metric value
         """
         try:
-            storage.insert(self)
+            storage.session.add(self)
+            AnalyticsRollup.apply(storage.session, [(self.metric_type, self.metric_value, self.timestamp)])
+            TrendCacheVersion.bump(storage.session, {self.metric_type})
+            storage.session.commit()
+            trend_cache.invalidate({self.metric_type})
         except Exception as e:
             logger.error(f"Failed to record metric: {e}")
+            storage.session.rollback()
+            raise
+
+    @staticmethod
+    def buffer_metrics(rows: list):
+        """
+        method definition that queues metric rows for a batched insert.
+        raises BufferFullError when the buffer cannot take them in time
+        """
+        metric_buffer.add(rows)
+
+    @staticmethod
+    def insert_rows(rows: list, session=None):
+        """
+        method definition that writes metric rows with one multi-row
+        insert and updates the rollups in the same transaction
+        """
+        session = session or storage.session
+        try:
+            session.execute(insert(Analytics), rows)
+            AnalyticsRollup.apply(session, [
+                (row['metric_type'], row['metric_value'], row['timestamp']) for row in rows
+                ])
+            TrendCacheVersion.bump(session, {row['metric_type'] for row in rows})
+            session.commit()
+            trend_cache.invalidate({row['metric_type'] for row in rows})
+        except Exception as e:
+            logger.error(f"Failed to insert {len(rows)} metrics: {e}")
+            session.rollback()
             raise
 
     @staticmethod
@@ -61,65 +168,147 @@ class Analytics():
             raise
 
     @staticmethod
-    def analyze_trends():
+    def encode_cursor(timestamp, analytics_id) -> str:
         """
-        method definition to analyze trends
-        from collected metrics over a specified time period
+        method definition for the opaque cursor of a keyset page
         """
+        raw = json.dumps([timestamp.isoformat(), analytics_id])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
         try:
-            if time_period.endswith('d'):
-                days = int(time_period[:-1])
-                start_date = datetime.now(pytz.timezone('Africa/Nairobi')) - timedelta(days=days)
-            else:
-                raise ValueError("Unsupported time period format.")
-
-            results = (
-                    storage.query(Analytics.metric_type, func.avg(Analytics.metric_value).label('average_value'))
-                    .filter(Analytics.timestamp >= start_date)
-                    .group_by(Analytics.metric_type)
-                    .all()
-                    )
-
-            trends = {
+            timestamp, analytics_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(timestamp), int(analytics_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError("Invalid cursor.") from e
+
+    @staticmethod
+    def page_query(user_id=None, metric_type=None, fields=None,
+            start=None, end=None, cursor=None, limit=100):
+        """
+        method definition for one keyset page of metrics ordered by
+        (timestamp, analytics_id). only the requested fields are
+        selected, plus the two cursor columns. it fetches limit + 1 rows
+        so the caller can tell whether another page exists
+        """
+        fields = fields or EXPORT_FIELDS
+        unknown = set(fields) - set(EXPORT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        columns = [Analytics.timestamp, Analytics.analytics_id] + [
+                getattr(Analytics, field) for field in fields
+                if field not in ('timestamp', 'analytics_id')
+                ]
+        query = storage.query(*columns)
+        if user_id:
+            query = query.filter(Analytics.user_id == user_id)
+        if metric_type:
+            query = query.filter(Analytics.metric_type == metric_type)
+        if start:
+            query = query.filter(Analytics.timestamp >= start)
+        if end:
+            query = query.filter(Analytics.timestamp < end)
+        if cursor:
+            timestamp, analytics_id = Analytics.decode_cursor(cursor)
+            query = query.filter(or_(
+                Analytics.timestamp > timestamp,
+                and_(Analytics.timestamp == timestamp, Analytics.analytics_id > analytics_id)))
+
+        return query.order_by(Analytics.timestamp, Analytics.analytics_id).limit(limit + 1)
+
+    @staticmethod
+    def analyze_trends(time_period='7d', metric_type=None):
+        """
+        method definition to analyze trends
+        from collected metrics over a specified time period.
+        it only reads the hourly/daily rollups, never raw metrics
+        """
+        def compute():
+            start_date, end_date = period_bounds(time_period)
+            summary = AnalyticsRollup.summarize(storage.session, start_date, end_date, metric_type)
+            return {
                     "time_period": time_period,
                     "start_date": start_date.isoformat(),
-                    "trends": {result.metric_type: result.average_value for result in results}
+                    "trends": {name: stats['average'] for name, stats in summary.items()},
+                    "summary": summary
                     }
-            return trends
+
+        try:
+            return trend_cache.cached(('averages', time_period, metric_type), metric_type, compute)
         except Exception as e:
             logger.error(f"Failed to analyze trends: {e}")
             raise
 
     @staticmethod
-    def export_data(file_format='json', file_path='analytics_export'):
+    def analyze_statistics(time_period='7d', statistics=('p50', 'p95', 'p99'),
+            metric_type=None, bucket='1h'):
+        """
+        method definition that loads the period's metrics into numpy
+        columns and computes the selected statistics per metric_type,
+        e.g percentiles, histograms, bucketed series, EWMA && rolling means
+        """
+        def compute():
+            start_date, end_date, bucket_seconds = statistics_window(time_period, bucket)
+            engine = TrendEngine(bucket_seconds=bucket_seconds)
+            window = MetricWindow.load(storage.session, start_date, end_date, metric_type)
+            return {
+                    "time_period": time_period,
+                    "start_date": start_date.isoformat(),
+                    "bucket": bucket,
+                    "trends": engine.compute(window, statistics)
+                    }
+
+        try:
+            key = ('statistics', time_period, metric_type, tuple(sorted(statistics)), bucket)
+            return trend_cache.cached(key, metric_type, compute)
+        except Exception as e:
+            logger.error(f"Failed to analyze statistics: {e}")
+            raise
+
+    @staticmethod
+    def stream_export(file_format='jsonl', compress=False, batch_size=1000):
+        """
+        method definition that yields the whole table as encoded
+        byte chunks. rows are read a page at a time by analytics_id
+        so memory use stays flat however large the table gets. the
+        first page is read before returning, so a failing query
+        raises here rather than mid-stream
+        """
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError("unsupported file format. Use json/jsonl/csv.")
+        columns = [getattr(Analytics, field) for field in EXPORT_FIELDS]
+        rows = keyset_pages(storage.query(*columns), Analytics.analytics_id, batch_size)
+        records = (
+                dict(row._mapping, timestamp=row.timestamp.isoformat() if row.timestamp else None)
+                for row in rows
+                )
+        return started(byte_chunks(encode_rows(records, file_format, EXPORT_FIELDS, batch_size), compress))
+
+    @staticmethod
+    def export_data(file_format='json', file_path='analytics_export', compress=False):
         """
         method definition that exports data in a specified file format
         """
         try:
-            data = storage.query(Analytics).all()
-            data_dicts = [
-                    {
-                        "analytics_id": record.analytics_id,
-                        "user_id": record.user_id,
-                        "task_id": record.task_id,
-                        "metric_type": record.metric_type,
-                        "metric_value": record.metric_value,
-                        "timestamp": record.timestamp.isoformat(),
-                        "report_data": record.report_data
-                        }
-                    for record in data
-                    ]
-            if file_format == 'json':
-                with open(f"{file_path}.json", 'w') as json_file:
-                    json.dump(data_dicts, json_file, indent=4)
-            elif file_format == 'csv':
-                with open(f"{file_path}.csv", 'w', newline='') as csv_file:
-                    writer = csv.DictWriter(csv_file, fieldnames=data_dicts[0].keys())
-                    writer.writeheader()
-                    writer.writerows(data_dicts)
-            else:
-                raise ValueError("unsupported file format. Use json/csv'.")
-        
+            file_name = f"{file_path}.{file_format}" + ('.gz' if compress else '')
+            chunks = Analytics.stream_export(file_format, compress)
+            with open(file_name, 'wb') as export_file:
+                for chunk in chunks:
+                    export_file.write(chunk)
+            return file_name
+
         except Exception as e:
             logger.error(f"Failed to export data: {e}")
             raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Analytics maintenance')
+    parser.add_argument('command', choices=['replay-dead-letters'])
+    args = parser.parse_args()
+
+    buffer = MetricBuffer(lambda rows: Analytics.insert_rows(rows, storage.session))
+    buffer.replay_dead_letters()
+    print(json.dumps({'dead_lettered_again': buffer.dead_lettered}))
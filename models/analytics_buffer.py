@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+in-process buffer that batches metric inserts
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from spill import SpillFile
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+class BufferFullError(Exception):
+    """
+    raised when the buffer stays full for longer than the put timeout
+    """
+
+
+def is_data_error(error: Exception) -> bool:
+    """
+    function definition for whether a failed write was caused by the
+    rows themselves (bad values, broken constraints) rather than by
+    the database being unreachable; only those are worth bisecting
+    """
+    if isinstance(error, (DataError, IntegrityError, LookupError, TypeError, ValueError)):
+        return True
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+
+class MetricBuffer:
+    """
+    class definition for a bounded buffer of metric rows that are
+    written with `write_batch` once `flush_size` rows are waiting
+    or every `flush_interval` seconds, whichever comes first
+        *max_size -> rows held before producers are pushed back
+        *put_timeout -> seconds a producer waits for room
+        *max_retries -> failed flushes while the database is unreachable
+                        before the buffer is spilled to `spill_path`;
+                        spilled rows are replayed after the next good flush
+        *dead_letter_path -> rows that fail on their own with a data error,
+                             replayed by replay_dead_letters once fixed
+    """
+    def __init__(self, write_batch, max_size: int = 10000, flush_size: int = 500,
+            flush_interval: float = 1.0, put_timeout: float = 0.5, max_retries: int = 3,
+            spill_path: str = 'logs/metric_spill.ndjson',
+            dead_letter_path: str = 'logs/metric_dead_letter.ndjson'):
+        self.write_batch = write_batch
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.spill = SpillFile(spill_path, flush_size)
+        self.dead_letters = SpillFile(dead_letter_path, flush_size)
+        self.spilled = 0
+        self.dead_lettered = 0
+        self._failures = 0
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    def start(self):
+        """
+        method definition that starts the flusher thread and makes
+        sure whatever is buffered gets written on shutdown
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metric-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def add(self, rows: list):
+        """
+        method definition that buffers rows, blocking for up to
+        put_timeout while the buffer is full
+        """
+        if len(rows) > self.max_size:
+            raise BufferFullError(f"Batch of {len(rows)} exceeds buffer size {self.max_size}")
+        deadline = time.monotonic() + self.put_timeout
+        with self._not_full:
+            while len(self._rows) + len(rows) > self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFullError("Metric buffer is full")
+                self._wake.set()
+                self._not_full.wait(remaining)
+            self._rows.extend(rows)
+            if len(self._rows) >= self.flush_size:
+                self._wake.set()
+
+    def _take(self, count: int) -> list:
+        with self._not_full:
+            rows = [self._rows.popleft() for _ in range(min(count, len(self._rows)))]
+            self._not_full.notify_all()
+            return rows
+
+    def flush(self, final: bool = False) -> int:
+        """
+        method definition that writes everything buffered, in batches
+        of flush_size, then replays spilled rows. a batch that fails
+        because the database is unreachable is put back for the next
+        flush, up to max_retries times in a row; then, or at once when
+        `final`, the whole buffer is spilled to disk so nothing is lost
+        and producers are not held up. returns the rows written
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take(self.flush_size)
+                if not batch:
+                    break
+                try:
+                    written += self._write(batch)
+                    self._failures = 0
+                except Exception as e:
+                    self._failures += 1
+                    logger.error(f"Failed to flush {len(batch)} metrics (attempt {self._failures}): {e}")
+                    if not final and self._failures < self.max_retries:
+                        with self._lock:
+                            self._rows.extendleft(reversed(batch))
+                        raise
+                    rows = batch + self._take(self.max_size)
+                    self._spill(rows)
+                    if final:
+                        return written
+                    raise
+            if written:
+                try:
+                    self.spill.replay(self._write)
+                except Exception as e:
+                    logger.error(f"Failed to replay spilled metrics: {e}")
+        return written
+
+    def _write(self, rows: list) -> int:
+        """
+        method definition that writes rows, bisecting them on data
+        errors so one bad row cannot hold up the rows around it; rows
+        that fail on their own are dead-lettered. raises, having written
+        nothing, when the database is unreachable. returns the rows written
+        """
+        try:
+            self.write_batch(rows)
+            return len(rows)
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(rows) == 1:
+                logger.error(f"Dead-lettering a metric: {e}")
+                self.dead_letters.append(rows)
+                self.dead_lettered += 1
+                return 0
+        return self._bisect(rows)
+
+    def _bisect(self, rows: list) -> int:
+        """
+        method definition that writes the halves of a batch separately.
+        when the database drops out midway, the rows not yet written
+        are spilled instead of being retried in pieces
+        """
+        middle = len(rows) // 2
+        written = 0
+        for start, half in ((0, rows[:middle]), (middle, rows[middle:])):
+            try:
+                written += self._write(half)
+            except Exception as e:
+                logger.error(f"Failed to write metrics while bisecting: {e}")
+                self._spill(rows[start:])
+                break
+        return written
+
+    def _spill(self, rows: list):
+        logger.error(f"Spilling {len(rows)} metrics to {self.spill.path}")
+        self.spill.append(rows)
+        self.spilled += len(rows)
+
+    def replay_dead_letters(self):
+        """
+        method definition that retries dead-lettered rows, e.g after
+        the schema or the data behind them was fixed. rows that still
+        fail are dead-lettered again
+        """
+        with self._flush_lock:
+            self.dead_letters.replay(self._write)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """
+        method definition that stops the flusher and writes
+        whatever is left in the buffer, spilling it when that fails
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush(final=True)
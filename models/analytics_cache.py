@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""
+read-through cache for analytics trend results
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import Column, Integer, String, update
+from upserts import upsert
+from user import Base
+
+"""
+the version row bumped by every write, for results covering all types
+"""
+ALL_TYPES = '*'
+
+
+class TrendCacheVersion(Base):
+    """
+    class definition for the shared version counter of each metric type.
+    writers bump it in the same transaction as their metrics, so every
+    worker process sees the change as soon as the metrics are visible
+    """
+    __tablename__ = 'analytics_cache_versions'
+
+    metric_type = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    def bump(session, metric_types=None):
+        """
+        method definition that increments the versions of the given
+        metric types && of ALL_TYPES, or of every type when metric_types
+        is None. rows are locked in sorted order. the caller commits
+        """
+        table = TrendCacheVersion.__table__
+        if metric_types is None:
+            session.execute(update(table).values(version=table.c.version + 1))
+            return
+
+        rows = [{'metric_type': metric_type, 'version': 1}
+                for metric_type in sorted(set(metric_types) | {ALL_TYPES})]
+        upsert(session, table, rows, ['metric_type'], lambda new: {'version': table.c.version + 1})
+
+    @staticmethod
+    def current(session, metric_type=None) -> int:
+        """
+        method definition for the version a result covering
+        metric_type (None meaning every type) was computed at
+        """
+        version = session.query(TrendCacheVersion.version).filter(
+                TrendCacheVersion.metric_type == (metric_type or ALL_TYPES)).scalar()
+        return version or 0
+
+
+class TrendCache:
+    """
+    class definition for an LRU cache of trend results with a TTL.
+    with `version_of`, a callable returning the shared version of a
+    metric type filter, entries are only served while that version is
+    unchanged, so a write by any worker process invalidates them.
+    versions read through `version_of` are kept for `version_ttl`
+    seconds rather than re-read on every lookup, so a write committed
+    by another worker can go unnoticed here, and older results be
+    served, for up to `version_ttl` seconds. writes made by this
+    process drop entries && cached versions right away
+    """
+    def __init__(self, max_entries: int = 256, ttl: float = 60.0, version_of=None,
+            version_ttl: float = 1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_of = version_of
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic() or entry[3] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def version(self, metric_type):
+        """
+        method definition for the shared version of metric_type,
+        read through `version_of` at most once per `version_ttl`
+        """
+        if self.version_of is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(metric_type)
+            if cached is not None and cached[1] > now:
+                return cached[0]
+            generation = self._generation
+        version = self.version_of(metric_type)
+        with self._lock:
+            if generation == self._generation:
+                self._versions[metric_type] = (version, now + self.version_ttl)
+        return version
+
+    def cached(self, key, metric_type, compute):
+        """
+        method definition that returns the cached result for key or
+        computes && stores it. `metric_type` is the filter the result
+        covers, None meaning every type. a result is not stored if an
+        invalidation happened while it was being computed
+        """
+        version = self.version(metric_type)
+        value = self.get(key, version)
+        if value is not None:
+            return value
+
+        with self._lock:
+            generation = self._generation
+        value = compute()
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (value, metric_type, time.monotonic() + self.ttl, version)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, metric_types=None):
+        """
+        method definition that drops entries covering any of the given
+        metric types, or every entry when metric_types is None
+        """
+        with self._lock:
+            self._generation += 1
+            if metric_types is None:
+                self._entries.clear()
+                self._versions.clear()
+                return
+            for metric_type in [None, *metric_types]:
+                self._versions.pop(metric_type, None)
+            for key in [key for key, (_, metric_type, _, _) in self._entries.items()
+                    if metric_type is None or metric_type in metric_types]:
+                del self._entries[key]
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+columnar trend engine: loads a window of metrics into numpy arrays
+and computes percentiles, histograms && time-bucketed series on them
+"""
+import logging
+import re
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+STATISTICS = ('count', 'mean', 'min', 'max', 'p50', 'p95', 'p99',
+        'histogram', 'series', 'ewma', 'rolling')
+BUCKET_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+"""
+every bucketed statistic allocates arrays of one slot per bucket,
+so windows are capped at this many buckets
+"""
+MAX_BUCKETS = 10000
+
+
+def parse_bucket(bucket: str) -> int:
+    """
+    function definition that turns '15m', '1h' or '1d' into seconds
+    """
+    match = re.fullmatch(r'(\d+)([mhd])', bucket or '')
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("Unsupported bucket format. Use e.g 15m, 1h or 1d.")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def bucket_count(start: float, end: float, bucket_seconds: int) -> int:
+    """
+    function definition for the number of buckets covering [start, end)
+    epoch seconds. raises ValueError above MAX_BUCKETS
+    """
+    count = max(int(np.ceil((end - start) / bucket_seconds)), 1)
+    if count > MAX_BUCKETS:
+        raise ValueError(f"Window spans {count} buckets, at most {MAX_BUCKETS} are allowed. "
+                "Use a shorter time_period or a larger bucket.")
+    return count
+
+
+class MetricWindow:
+    """
+    class definition for a window of metrics held as compact columns
+        *timestamps -> float64 epoch seconds
+        *values -> float64 metric values
+        *codes -> int32 index into metric_types
+    """
+    def __init__(self, timestamps, values, codes, metric_types, start, end):
+        self.timestamps = timestamps
+        self.values = values
+        self.codes = codes
+        self.metric_types = metric_types
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def load(cls, session, start, end, metric_type=None, batch_size: int = 50000):
+        """
+        method definition that streams (timestamp, value, type) columns
+        for [start, end) into arrays without building ORM objects.
+        rows whose value is not numeric are dropped
+        """
+        from analytics import Analytics
+
+        query = session.query(Analytics.timestamp, Analytics.metric_value, Analytics.metric_type).filter(
+                Analytics.timestamp >= start, Analytics.timestamp < end)
+        if metric_type:
+            query = query.filter(Analytics.metric_type == metric_type)
+
+        type_codes = {}
+        chunks = []
+        timestamps, values, codes = [], [], []
+        for timestamp, metric_value, name in query.yield_per(batch_size):
+            try:
+                value = float(metric_value)
+            except (TypeError, ValueError):
+                continue
+            timestamps.append(timestamp.timestamp())
+            values.append(value)
+            codes.append(type_codes.setdefault(name, len(type_codes)))
+            if len(values) >= batch_size:
+                chunks.append((np.array(timestamps), np.array(values), np.array(codes, dtype=np.int32)))
+                timestamps, values, codes = [], [], []
+        chunks.append((np.array(timestamps, dtype=np.float64), np.array(values, dtype=np.float64),
+            np.array(codes, dtype=np.int32)))
+
+        return cls(
+                np.concatenate([chunk[0] for chunk in chunks]),
+                np.concatenate([chunk[1] for chunk in chunks]),
+                np.concatenate([chunk[2] for chunk in chunks]),
+                list(type_codes), start.timestamp(), end.timestamp())
+
+
+def _series(values):
+    return [None if np.isnan(value) else float(value) for value in values]
+
+
+def ewma(series, alpha: float):
+    """
+    function definition for the exponentially weighted moving average
+    of a bucketed series. empty (NaN) buckets carry the last average
+    """
+    out = np.empty_like(series)
+    average = np.nan
+    for i, value in enumerate(series):
+        if not np.isnan(value):
+            average = value if np.isnan(average) else alpha * value + (1 - alpha) * average
+        out[i] = average
+    return out
+
+
+def rolling_mean(sums, counts, window: int):
+    """
+    function definition for the rolling mean over `window` buckets,
+    weighted by how many metrics fell in each bucket
+    """
+    sum_windows = np.convolve(sums, np.ones(window), 'full')[:len(sums)]
+    count_windows = np.convolve(counts, np.ones(window), 'full')[:len(counts)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count_windows > 0, sum_windows / count_windows, np.nan)
+
+
+class TrendEngine:
+    """
+    class definition for vectorized aggregates over a MetricWindow
+    """
+    def __init__(self, bucket_seconds: int = 3600, bins: int = 20,
+            alpha: float = 0.3, window: int = 24):
+        self.bucket_seconds = bucket_seconds
+        self.bins = bins
+        self.alpha = alpha
+        self.window = window
+
+    def compute(self, metric_window: MetricWindow, statistics) -> dict:
+        """
+        method definition that returns the requested statistics
+        for every metric_type in the window
+        """
+        unknown = set(statistics) - set(STATISTICS)
+        if unknown:
+            raise ValueError(f"Unsupported statistics: {', '.join(sorted(unknown))}")
+
+        buckets_total = bucket_count(metric_window.start, metric_window.end, self.bucket_seconds)
+        buckets = ((metric_window.timestamps - metric_window.start) // self.bucket_seconds).astype(np.int64)
+        buckets = np.clip(buckets, 0, buckets_total - 1)
+
+        results = {}
+        for code, metric_type in enumerate(metric_window.metric_types):
+            mask = metric_window.codes == code
+            values = metric_window.values[mask]
+            stats = {}
+
+            if 'count' in statistics:
+                stats['count'] = int(values.size)
+            if 'mean' in statistics:
+                stats['mean'] = float(values.mean())
+            if 'min' in statistics:
+                stats['min'] = float(values.min())
+            if 'max' in statistics:
+                stats['max'] = float(values.max())
+
+            wanted = [p for p in ('p50', 'p95', 'p99') if p in statistics]
+            if wanted:
+                for name, value in zip(wanted, np.percentile(values, [int(p[1:]) for p in wanted])):
+                    stats[name] = float(value)
+
+            if 'histogram' in statistics:
+                counts, edges = np.histogram(values, bins=self.bins)
+                stats['histogram'] = {'counts': counts.tolist(), 'edges': edges.tolist()}
+
+            if {'series', 'ewma', 'rolling'} & set(statistics):
+                sums = np.bincount(buckets[mask], weights=values, minlength=buckets_total)
+                counts = np.bincount(buckets[mask], minlength=buckets_total).astype(np.float64)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means = np.where(counts > 0, sums / counts, np.nan)
+                if 'series' in statistics:
+                    stats['series'] = _series(means)
+                if 'ewma' in statistics:
+                    stats['ewma'] = _series(ewma(means, self.alpha))
+                if 'rolling' in statistics:
+                    stats['rolling'] = _series(rolling_mean(sums, counts, self.window))
+
+            results[metric_type] = stats
+
+        return results
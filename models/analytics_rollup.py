@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+hourly && daily per-metric_type rollups of the analytics table,
+so trend queries never have to scan raw metrics
+"""
+import logging
+from datetime import timedelta
+from sqlalchemy import Column, DateTime, Enum, Float, Integer, String, delete, func, or_
+from streaming import keyset_pages
+from upserts import upsert
+from user import Base
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+GRANULARITIES = ('hour', 'day')
+
+
+def bucket_start(timestamp, granularity: str):
+    """
+    function definition that truncates a timestamp to its bucket
+    """
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+class AnalyticsRollup(Base):
+    """
+    class definition for count/sum/min/max of one metric_type
+    over one hour or one day
+    """
+    __tablename__ = 'analytics_rollups'
+
+    granularity = Column(Enum(*GRANULARITIES), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    metric_type = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+
+    @staticmethod
+    def aggregate(metrics) -> list:
+        """
+        method definition that folds (metric_type, metric_value, timestamp)
+        tuples into rollup rows for every granularity.
+        values that are not numeric are skipped
+        """
+        buckets = {}
+        for metric_type, metric_value, timestamp in metrics:
+            try:
+                value = float(metric_value)
+            except (TypeError, ValueError):
+                logger.error(f"Skipping non-numeric {metric_type} value {metric_value!r} in rollup")
+                continue
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(timestamp, granularity), metric_type)
+                row = buckets.get(key)
+                if row is None:
+                    buckets[key] = {
+                            'granularity': granularity, 'bucket_start': key[1],
+                            'metric_type': metric_type, 'count': 1, 'total': value,
+                            'min_value': value, 'max_value': value,
+                            }
+                else:
+                    row['count'] += 1
+                    row['total'] += value
+                    row['min_value'] = min(row['min_value'], value)
+                    row['max_value'] = max(row['max_value'], value)
+        return list(buckets.values())
+
+    @staticmethod
+    def apply(session, metrics):
+        """
+        method definition that merges new metrics into the rollups
+        with one multi-row upsert. the caller commits
+        """
+        table = AnalyticsRollup.__table__
+        on_sqlite = session.get_bind().dialect.name == 'sqlite'
+        least, greatest = (func.min, func.max) if on_sqlite else (func.least, func.greatest)
+        upsert(session, table, AnalyticsRollup.aggregate(metrics),
+                ['granularity', 'bucket_start', 'metric_type'],
+                lambda new: {
+                    'count': table.c.count + new.count,
+                    'total': table.c.total + new.total,
+                    'min_value': least(table.c.min_value, new.min_value),
+                    'max_value': greatest(table.c.max_value, new.max_value),
+                    })
+
+    @staticmethod
+    def compact(session, start, end, batch_size: int = 10000):
+        """
+        method definition for the compaction job: it rebuilds the
+        rollups of every day touched by [start, end) from raw metrics,
+        e.g after a backfill or to correct drift
+        """
+        from analytics import Analytics
+        from analytics_cache import TrendCacheVersion
+
+        start = bucket_start(start, 'day')
+        end = bucket_start(end, 'day') + timedelta(days=1)
+        try:
+            session.execute(delete(AnalyticsRollup).where(
+                AnalyticsRollup.bucket_start >= start,
+                AnalyticsRollup.bucket_start < end))
+
+            query = session.query(Analytics.analytics_id, Analytics.metric_type,
+                    Analytics.metric_value, Analytics.timestamp).filter(
+                            Analytics.timestamp >= start, Analytics.timestamp < end)
+            batch = []
+            for row in keyset_pages(query, Analytics.analytics_id, batch_size):
+                batch.append((row.metric_type, row.metric_value, row.timestamp))
+                if len(batch) >= batch_size:
+                    AnalyticsRollup.apply(session, batch)
+                    batch = []
+            AnalyticsRollup.apply(session, batch)
+            TrendCacheVersion.bump(session)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Failed to compact rollups: {e}")
+            session.rollback()
+            raise
+
+    @staticmethod
+    def summarize(session, start, end, metric_type=None) -> dict:
+        """
+        method definition that answers a [start, end) range from rollups:
+        whole days come from day buckets, the partial edge days from
+        hour buckets. start is rounded down to its hour
+        """
+        first_day = bucket_start(start, 'day')
+        if first_day < start:
+            first_day += timedelta(days=1)
+        last_day = bucket_start(end, 'day')
+
+        if first_day < last_day:
+            ranges = or_(
+                    (AnalyticsRollup.granularity == 'day')
+                    & (AnalyticsRollup.bucket_start >= first_day)
+                    & (AnalyticsRollup.bucket_start < last_day),
+                    (AnalyticsRollup.granularity == 'hour')
+                    & (AnalyticsRollup.bucket_start >= bucket_start(start, 'hour'))
+                    & (AnalyticsRollup.bucket_start < first_day),
+                    (AnalyticsRollup.granularity == 'hour')
+                    & (AnalyticsRollup.bucket_start >= last_day)
+                    & (AnalyticsRollup.bucket_start < end))
+        else:
+            ranges = ((AnalyticsRollup.granularity == 'hour')
+                    & (AnalyticsRollup.bucket_start >= bucket_start(start, 'hour'))
+                    & (AnalyticsRollup.bucket_start < end))
+
+        query = session.query(
+                AnalyticsRollup.metric_type,
+                func.sum(AnalyticsRollup.count).label('count'),
+                func.sum(AnalyticsRollup.total).label('total'),
+                func.min(AnalyticsRollup.min_value).label('min_value'),
+                func.max(AnalyticsRollup.max_value).label('max_value'),
+                ).filter(ranges)
+        if metric_type:
+            query = query.filter(AnalyticsRollup.metric_type == metric_type)
+
+        return {
+                row.metric_type: {
+                    'count': row.count,
+                    'sum': row.total,
+                    'min': row.min_value,
+                    'max': row.max_value,
+                    'average': row.total / row.count if row.count else None,
+                    }
+                for row in query.group_by(AnalyticsRollup.metric_type)
+                }
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+batch-level hash chaining of the audit log for tamper evidence.
+every flushed batch stores sha256(previous digest + its rows), so
+editing, deleting or inserting a logged row breaks the chain from
+that batch on, for one small write per batch instead of per row.
+rows written outside the writer after the chain started carry no
+batch and are reported as unchained.
+
+the chain is not keyed: anyone who can write to the database can
+rewrite rows and recompute every digest after them. it only proves
+tampering against such a writer when the head digest reported by
+`verify` is also kept somewhere they cannot reach, e.g. shipped to
+another system or printed into the ops log on every run
+
+usage:
+    python audit_chain.py verify
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, func, update
+from sqlalchemy.exc import IntegrityError
+from streaming import keyset_pages
+from user import Base
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+GENESIS_DIGEST = '0' * 64
+CHAIN_FIELDS = [
+        'log_id', 'user_id', 'action_type', 'entity_type', 'entity_id',
+        'timestamp', 'details', 'ip_address', 'status'
+        ]
+
+
+def encode_row(row) -> bytes:
+    """
+    function definition for the canonical bytes of one audit row
+    """
+    values = [getattr(row, field) for field in CHAIN_FIELDS]
+    values[CHAIN_FIELDS.index('timestamp')] = row.timestamp.isoformat()
+    return json.dumps(values, separators=(',', ':')).encode() + b'\n'
+
+
+def batch_digest(prev_digest: str, rows) -> str:
+    """
+    function definition for the digest of a batch, rows in log_id order
+    """
+    digest = hashlib.sha256(prev_digest.encode())
+    for row in rows:
+        digest.update(encode_row(row))
+    return digest.hexdigest()
+
+
+class AuditLogBatch(Base):
+    """
+    class definition for one link of the chain. prev_digest is unique,
+    so two writers racing for the same chain head cannot both commit
+    """
+    __tablename__ = 'audit_log_batches'
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(String(32), nullable=False, unique=True)
+    prev_digest = Column(String(64), nullable=False, unique=True)
+    digest = Column(String(64), nullable=False)
+    row_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    archived = Column(Boolean, nullable=False, default=False)
+
+
+def append_batch(session, batch_id: str, rows, attempts: int = 5):
+    """
+    function definition that links a freshly inserted batch onto the
+    chain head. rows must carry CHAIN_FIELDS in log_id order as read
+    back from the database; the caller commits. a writer that loses
+    the race for the head (the unique prev_digest) re-reads the new
+    head and links onto it instead of failing the whole batch
+    """
+    for attempt in range(attempts):
+        head = (session.query(AuditLogBatch.digest)
+                .order_by(AuditLogBatch.seq.desc())
+                .with_for_update().limit(1).scalar())
+        prev_digest = head or GENESIS_DIGEST
+        digest = batch_digest(prev_digest, rows)
+        try:
+            with session.begin_nested():
+                session.add(AuditLogBatch(
+                    batch_id=batch_id, prev_digest=prev_digest, digest=digest,
+                    row_count=len(rows), created_at=datetime.now(), archived=False))
+            return
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def mark_archived(session, batch_ids):
+    """
+    function definition that flags batches whose rows were archived,
+    so the verifier only checks their links. the caller commits
+    """
+    batch_ids = list(batch_ids)
+    for i in range(0, len(batch_ids), 1000):
+        session.execute(update(AuditLogBatch)
+                .where(AuditLogBatch.batch_id.in_(batch_ids[i:i + 1000]))
+                .values(archived=True))
+
+
+def _check_batches(session, headers, prev_digest: str, problem, batch_size: int) -> tuple:
+    """
+    function definition that checks one page of batch headers in seq
+    order: each must link to the digest before it, and the rows of the
+    live ones must hash to their digest. returns the last digest and
+    the number of rows hashed
+    """
+    from audit_logs import AuditLog
+
+    digests = {header.batch_id: hashlib.sha256(header.prev_digest.encode())
+            for header in headers if not header.archived}
+    counts = {}
+    if digests:
+        columns = [getattr(AuditLog, field) for field in CHAIN_FIELDS] + [AuditLog.batch_id]
+        rows = (session.query(*columns)
+                .filter(AuditLog.batch_id.in_(list(digests)))
+                .order_by(AuditLog.log_id)
+                .yield_per(batch_size))
+        for row in rows:
+            digests[row.batch_id].update(encode_row(row))
+            counts[row.batch_id] = counts.get(row.batch_id, 0) + 1
+
+    for header in headers:
+        if header.prev_digest != prev_digest:
+            problem(f"batch {header.seq} does not link to the batch before it")
+        prev_digest = header.digest
+        if header.archived:
+            continue
+        count = counts.get(header.batch_id, 0)
+        if count != header.row_count:
+            problem(f"batch {header.seq} has {count} rows, expected {header.row_count}")
+        elif digests[header.batch_id].hexdigest() != header.digest:
+            problem(f"batch {header.seq} digest mismatch")
+    return prev_digest, sum(counts.values())
+
+
+def verify(session, batch_size: int = 10000, max_problems: int = 100, page_size: int = 1000) -> dict:
+    """
+    function definition that validates the whole chain. batch headers
+    are walked by seq a page at a time, carrying only the previous
+    digest between pages, and each page's rows are streamed by their
+    indexed batch_id, so memory depends on the page, not the chain.
+    rows without a batch count as problems once the chain has started:
+    those older than the first chained row predate it
+    """
+    from audit_logs import AuditLog
+
+    started = time.perf_counter()
+    problems = []
+
+    def problem(message):
+        if len(problems) < max_problems:
+            problems.append(message)
+
+    batches = 0
+    rows_checked = 0
+    prev_digest = GENESIS_DIGEST
+    page = []
+    query = session.query(AuditLogBatch.seq, AuditLogBatch.batch_id, AuditLogBatch.prev_digest,
+            AuditLogBatch.digest, AuditLogBatch.row_count, AuditLogBatch.archived)
+    for header in keyset_pages(query, AuditLogBatch.seq, page_size):
+        page.append(header)
+        if len(page) == page_size:
+            prev_digest, checked = _check_batches(session, page, prev_digest, problem, batch_size)
+            batches += len(page)
+            rows_checked += checked
+            page = []
+    if page:
+        prev_digest, checked = _check_batches(session, page, prev_digest, problem, batch_size)
+        batches += len(page)
+        rows_checked += checked
+
+    orphans = (session.query(AuditLog.log_id, AuditLog.batch_id)
+            .outerjoin(AuditLogBatch, AuditLogBatch.batch_id == AuditLog.batch_id)
+            .filter(AuditLog.batch_id.isnot(None), AuditLogBatch.seq.is_(None))
+            .order_by(AuditLog.log_id).limit(max_problems))
+    for row in orphans:
+        problem(f"log {row.log_id} belongs to unknown batch {row.batch_id}")
+
+    if batches:
+        unchained = session.query(AuditLog.log_id).filter(AuditLog.batch_id.is_(None))
+        chain_start = session.query(func.min(AuditLog.log_id)).filter(AuditLog.batch_id.isnot(None)).scalar()
+        if chain_start is not None:
+            unchained = unchained.filter(AuditLog.log_id > chain_start)
+        for row in unchained.order_by(AuditLog.log_id).limit(max_problems):
+            problem(f"log {row.log_id} was written outside the chain")
+
+    elapsed = time.perf_counter() - started
+    return {
+            'valid': not problems,
+            'batches': batches,
+            'head': prev_digest,
+            'rows': rows_checked,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows_checked / elapsed) if elapsed else rows_checked,
+            'problems': problems,
+            }
+
+
+if __name__ == "__main__":
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description='Audit log hash chain')
+    parser.add_argument('command', choices=['verify'])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    report = verify(Storage().session, args.batch_size)
+    print(json.dumps(report, indent=4))
+    sys.exit(0 if report['valid'] else 1)
@@ -2,15 +2,27 @@
 """
 this is the audit logs model for our platform
 """
+import base64
+import heapq
 import logging
 import pytz
-import csv
 import json
+import uuid
 from datetime import datetime
+from operator import itemgetter
 from storage import Storage
-from sqlalchemy import Enum, String, JSON
+from sqlalchemy import Column, DateTime, Enum, Index, Integer, String, Text, JSON, and_, insert, or_, select
 from sqlalchemy.dialects.mysql import INTEGER
 from sqlalchemy.exc import SQLAlchemyError
+import audit_chain
+import audit_partitions
+import audit_search
+from audit_summary import AuditDailyCount
+from audit_writer import AuditWriter
+from lazy import LazyObject
+from sessions import background_session
+from streaming import EXPORT_FORMATS, byte_chunks, encode_rows, started
+from user import Base
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
@@ -18,11 +30,54 @@ logger.setLevel(logging.ERROR)
 ACTION_TYPES = Enum('create', 'update', 'delete', 'view')
 ENTITY_TYPES = Enum('user', 'task', 'payment')
 
+storage = LazyObject(Storage)
 
-class AuditLog:
+EXPORT_FIELDS = [
+        'log_id', 'user_id', 'action_type', 'entity_type',
+        'entity_id', 'timestamp', 'details', 'ip_address', 'status'
+        ]
+
+
+def start_audit_writer() -> AuditWriter:
+    """
+    function definition for the audit writer. its thread
+    writes through a session of its own
+    """
+    session = background_session(storage)
+    return AuditWriter(lambda rows: AuditLog.insert_rows(rows, session)).start()
+
+
+"""
+log_action only queues the entry; this writer inserts them in batches
+"""
+audit_writer = LazyObject(start_audit_writer)
+
+
+class AuditLog(Base):
     """
     class definition for the audit logs model
     """
+    __tablename__ = 'audit_logs'
+    __table_args__ = (
+            Index('ft_audit_logs_details', 'details', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+            Index('ix_audit_logs_user_time', 'user_id', 'timestamp'),
+            Index('ix_audit_logs_entity_time', 'entity_type', 'timestamp'),
+            Index('ix_audit_logs_status_action_time', 'status', 'action_type', 'timestamp'),
+            Index('ix_audit_logs_action_time', 'action_type', 'timestamp'),
+            Index('ix_audit_logs_time', 'timestamp'),
+            )
+
+    log_id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    action_type = Column(ACTION_TYPES, nullable=False)
+    entity_type = Column(ENTITY_TYPES, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    details = Column(Text, nullable=True)
+    ip_address = Column(String(45), nullable=True)
+    status = Column(String(20), nullable=False, default='success')
+    batch_id = Column(String(32), nullable=True, index=True)
+
     def __init__(self, user_id, action_type,
             entity_type, entity_id,
             details=None, ip_address=None,
@@ -37,158 +92,261 @@ class AuditLog:
         self.ip_address = ip_address
         self.status = status
 
+    @staticmethod
+    def validate_entry(data: dict):
+        """
+        method definition that checks an entry before it is queued.
+        the writer inserts it later, outside the request, so a bad
+        value must be rejected here rather than fail the whole batch
+        """
+        for field in ('user_id', 'entity_id'):
+            if not isinstance(data.get(field), int) or isinstance(data.get(field), bool):
+                raise ValueError(f"{field} must be an integer")
+        if data.get('action_type') not in ACTION_TYPES.enums:
+            raise ValueError(f"action_type must be one of {', '.join(ACTION_TYPES.enums)}")
+        if data.get('entity_type') not in ENTITY_TYPES.enums:
+            raise ValueError(f"entity_type must be one of {', '.join(ENTITY_TYPES.enums)}")
+        status = data.get('status', 'success')
+        if not isinstance(status, str) or not 0 < len(status) <= AuditLog.status.type.length:
+            raise ValueError(f"status must be a string of at most {AuditLog.status.type.length} characters")
+        ip_address = data.get('ip_address')
+        if ip_address is not None and (not isinstance(ip_address, str)
+                or len(ip_address) > AuditLog.ip_address.type.length):
+            raise ValueError(f"ip_address must be a string of at most {AuditLog.ip_address.type.length} characters")
+
     def log_action(self):
         """
-        method definition that records an action in the audit log
+        method definition that records an action in the audit log.
+        the entry is queued and written by the background audit writer
+        """
+        log_entry = {
+                'user_id': self.user_id,
+                'action_type': self.action_type,
+                'entity_type': self.entity_type,
+                'entity_id': self.entity_id,
+                'timestamp': self.timestamp.replace(tzinfo=None),
+                'details': self.details if self.details is None or isinstance(self.details, str)
+                else json.dumps(self.details),
+                'ip_address': self.ip_address,
+                'status': self.status
+                }
+        audit_writer.submit(log_entry)
+
+    @staticmethod
+    def insert_rows(rows: list, session=None):
         """
+        method definition that writes a batch of audit entries
+        with one multi-row insert, updating the daily counters and
+        linking the batch onto the hash chain in the same transaction
+        """
+        batch_id = uuid.uuid4().hex
+        rows = [dict(row, batch_id=batch_id) for row in rows]
+        columns = [getattr(AuditLog, field) for field in audit_chain.CHAIN_FIELDS]
+        session = session or storage.session
         try:
-            storage = Storage()
-            log_entry = {
-                    'user_id': self.user_id,
-                    'action_type': self.action_type,
-                    'entity_type': self.entity_type,
-                    'timestamp': self.timestamp,
-                    'details': self.details,
-                    'ip_address': self.ip_address,
-                    'status': self.status
-                    }
-            storage.insert(log_entry)
+            if session.get_bind().dialect.insert_executemany_returning:
+                inserted = session.execute(
+                        insert(AuditLog).returning(*columns, sort_by_parameter_order=True), rows).all()
+            else:
+                session.execute(insert(AuditLog), rows)
+                inserted = session.execute(select(*columns).where(
+                    AuditLog.batch_id == batch_id).order_by(AuditLog.log_id)).all()
+            if not audit_search.uses_fulltext(session):
+                audit_search.index_rows(session, [(row.log_id, row.details) for row in inserted])
+            AuditDailyCount.apply(session, rows)
+            audit_chain.append_batch(session, batch_id, inserted)
+            session.commit()
         except SQLAlchemyError as e:
-            logger.error(f"Failed to log action: {e}")
+            logger.error(f"Failed to insert {len(rows)} audit logs: {e}")
+            session.rollback()
             raise
 
     @staticmethod
-    def fetch_logs(user_id=None, entity_type=None, date_range=None):
+    def from_record(record: dict):
+        """
+        method definition that rebuilds a detached AuditLog from an
+        archived record, so archived && live logs serialize the same
+        """
+        log = AuditLog(record['user_id'], record['action_type'], record['entity_type'],
+                record['entity_id'], record['details'], record['ip_address'], record['status'])
+        log.log_id = record['log_id']
+        log.timestamp = record['timestamp']
+        log.batch_id = record.get('batch_id')
+        return log
+
+    def serialize(self) -> dict:
+        return {
+                'log_id': self.log_id,
+                'user_id': self.user_id,
+                'action_type': self.action_type,
+                'entity_type': self.entity_type,
+                'entity_id': self.entity_id,
+                'timestamp': self.timestamp.isoformat(),
+                'details': self.details,
+                'ip_address': self.ip_address,
+                'status': self.status
+                }
+
+    @staticmethod
+    def writer_metrics() -> dict:
         """
-        method definition to retrieve logs based on some filters
+        method definition for the audit writer's queue depth,
+        flush latency && delivery counters
+        """
+        return audit_writer.metrics()
+
+    @staticmethod
+    def encode_cursor(timestamp, log_id) -> str:
+        """
+        method definition for the opaque cursor of a keyset page
+        """
+        raw = json.dumps([timestamp.isoformat(), log_id])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        try:
+            timestamp, log_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(timestamp), int(log_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError("Invalid cursor.") from e
+
+    @staticmethod
+    def filter_query(query, user_id=None, entity_type=None, status=None,
+            action_type=None, date_range=None):
+        """
+        method definition that applies the audit log filters to a query.
+        every combination is served by one of the composite indexes
+        """
+        if user_id:
+            query = query.filter(AuditLog.user_id == user_id)
+        if entity_type:
+            query = query.filter(AuditLog.entity_type == entity_type)
+        if status:
+            query = query.filter(AuditLog.status == status)
+        if action_type:
+            query = query.filter(AuditLog.action_type == action_type)
+        if date_range:
+            start_date, end_date = date_range
+            query = query.filter(AuditLog.timestamp.between(start_date, end_date))
+        return query
+
+    @staticmethod
+    def page_query(cursor=None, limit=100, **filters):
+        """
+        method definition for one keyset page of logs ordered by
+        (timestamp, log_id). it fetches limit + 1 rows so the
+        caller can tell whether another page exists
+        """
+        query = AuditLog.filter_query(storage.query(AuditLog), **filters)
+        if cursor:
+            timestamp, log_id = AuditLog.decode_cursor(cursor)
+            query = query.filter(or_(
+                AuditLog.timestamp > timestamp,
+                and_(AuditLog.timestamp == timestamp, AuditLog.log_id > log_id)))
+        return query.order_by(AuditLog.timestamp, AuditLog.log_id).limit(limit + 1)
+
+    @staticmethod
+    def _page(logs, limit) -> tuple:
+        if len(logs) <= limit:
+            return logs, None
+        last = logs[limit - 1]
+        return logs[:limit], AuditLog.encode_cursor(last.timestamp, last.log_id)
+
+    @staticmethod
+    def verify_integrity() -> dict:
+        """
+        method definition that validates the audit log hash chain
+        """
+        return audit_chain.verify(storage.session)
+
+    @staticmethod
+    def fetch_logs(user_id=None, entity_type=None, date_range=None, include_archive=False,
+            cursor=None, limit=100):
+        """
+        method definition to retrieve one page of logs based on some
+        filters, as (logs, next_cursor). date_range filters only scan
+        the monthly partitions they overlap; with include_archive,
+        archived months in the range are read too
         """
         try:
-            storage = Storage()
-            query = storage.query(AuditLog)
-
-            if user_id:
-                query = query.filter(AuditLog.user_id == user_id)
-            if entity_type:
-                query = query.filter(AuditLog.entity_type == entity_type)
-            if date_range:
-                start_date, end_date = date_range
-                query = query.filter(AuditLog.timestamp.between(start_date, end_date))
-
-            return query.all()
+            logs = AuditLog.page_query(cursor, limit, user_id=user_id, entity_type=entity_type,
+                    date_range=date_range).all()
+            if include_archive and date_range:
+                archived = audit_partitions.read_archives(
+                        *date_range, user_id=user_id, entity_type=entity_type)
+                if cursor:
+                    after = AuditLog.decode_cursor(cursor)
+                    archived = (record for record in archived
+                            if (record['timestamp'], record['log_id']) > after)
+                oldest = heapq.nsmallest(limit + 1, archived, key=itemgetter('timestamp', 'log_id'))
+                logs = heapq.nsmallest(limit + 1, [AuditLog.from_record(record) for record in oldest] + logs,
+                        key=lambda log: (log.timestamp, log.log_id))
+            return AuditLog._page(logs, limit)
         except SQLAlchemyError as e:
             logger.error(f"Error fetching logs: {e}")
             raise
 
     @staticmethod
-    def search_logs(keyword):
+    def search_logs(keyword, mode='and', page=1, per_page=50):
         """
         method definition that allows one to search logs based
-        on a keyword in the 'details' field
+        on keywords in the 'details' field. results are ranked by
+        relevance and paginated; mode is 'and' (all terms) or 'or'
         """
         try:
-            storage = Storage()
-            return storage.query(AuditLog).filter(
-                    AuditLog.details.contains(keyword)
-                    ).all()
+            return audit_search.search(storage.session, keyword, mode,
+                    limit=per_page, offset=(page - 1) * per_page)
         except SQLAlchemyError as e:
             logger.error(f"Error searching logs with keyword '{keyword}': {e}")
             raise
 
     @staticmethod
-    def filter_logs(status=None, action_type=None):
+    def filter_logs(status=None, action_type=None, date_range=None, cursor=None, limit=100):
         """
-        method definition that filters logs based
-        on status or action type
+        method definition that filters logs based on status or
+        action type, one keyset page at a time as (logs, next_cursor)
         """
         try:
-            storage = Storage()
-            query = storage.query(AuditLog)
-
-            if status:
-                query = query.filter(AuditLog.status == status)
-            if action_type:
-                query = query.filter(AuditLog.action_type == action_type)
-
-            return query.all()
+            logs = AuditLog.page_query(cursor, limit, status=status, action_type=action_type,
+                    date_range=date_range).all()
+            return AuditLog._page(logs, limit)
         except SQLAlchemyError as e:
             logger.error(f"Error filtering logs: {e}")
             raise
 
     @staticmethod
-    def export_logs(file_format='csv'):
+    def export_logs(file_format='csv', compress=False, batch_size=1000,
+            user_id=None, entity_type=None, date_range=None, status=None, action_type=None):
         """
-        method definition that exports logs to a specified file format
+        method definition that exports the logs matching the filters
+        as encoded byte chunks. rows come off a server-side cursor
+        `batch_size` at a time, so memory use stays flat however
+        many logs match. the first batch is read before returning,
+        so a failing query raises here rather than mid-stream
         """
-        logs = AuditLog.fetch_logs()
-        try:
-            if file_format == 'csv':
-                file_name = "logs/exported_logs"
-                with open(file_name, mode='w', newline='') as csvfile:
-                    fieldnames = [
-                        'log_id', 'user_id', 'action_type', 'entity_type',
-                        'entity_id', 'timestamp', 'details', 'ip_address', 'status'
-                    ]
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                    writer.writeheader()
-                    for log in logs:
-                        writer.writerow({
-                            'log_id': log.log_id,
-                            'user_id': log.user_id,
-                            'action_type': log.action_type,
-                            'entity_type': log.entity_type,
-                            'entity_id': log.entity_id,
-                            'timestamp': log.timestamp.isoformat(),
-                            'details': log.details,
-                            'ip_address': log.ip_address,
-                            'status': log.status
-                        })
-                logger.info(f"Logs exported successfully to {file_name}.")
-
-            elif file_format == 'json':
-                file_name = f"{file_path}.json"
-                with open(file_name, mode='w') as jsonfile:
-                    json_logs = [
-                        {
-                            'log_id': log.log_id,
-                            'user_id': log.user_id,
-                            'action_type': log.action_type,
-                            'entity_type': log.entity_type,
-                            'entity_id': log.entity_id,
-                            'timestamp': log.timestamp.isoformat(),
-                            'details': log.details,
-                            'ip_address': log.ip_address,
-                            'status': log.status
-                        }
-                        for log in logs
-                    ]
-                    json.dump(json_logs, jsonfile, indent=4)
-                logger.info(f"Logs exported successfully to {file_name}.")
+        if file_format not in EXPORT_FORMATS:
+            logger.error("Unsupported file format for export.")
+            raise ValueError("Unsupported file format for export. Use csv/jsonl/json.")
 
-            else:
-                logger.error("Unsupported file format for export.")
-                raise ValueError("Unsupported file format for export.")
-        except Exception as e:
-            logger.error(f"Failed to export logs: {e}")
-            raise
+        columns = [getattr(AuditLog, field) for field in EXPORT_FIELDS]
+        query = AuditLog.filter_query(storage.query(*columns), user_id=user_id, entity_type=entity_type,
+                status=status, action_type=action_type, date_range=date_range)
+
+        rows = query.order_by(AuditLog.log_id).yield_per(batch_size)
+        records = (dict(row._mapping, timestamp=row.timestamp.isoformat()) for row in rows)
+        return started(byte_chunks(encode_rows(records, file_format, EXPORT_FIELDS, batch_size), compress))
 
     @staticmethod
     def generate_summary(time_period=None):
         """
         method definition that generates a summary of log actions
-        for a certain time period
+        for a certain time period, as (action_type, count) pairs.
+        it reads the daily counters and only scans partial edge days
         """
         try:
-            storage = Storage()
-            query = storage.query(AuditLog).with_entities(
-                    AuditLog.action_type,
-                    db.func.count(AuditLog.action_type)
-                    ).group_by(AuditLog.action_type)
-            if time_period:
-                start_date, end_date = time_period
-                query = query.filter(AuditLog.timestamp.between(start_date, end_date))
-
-            return query.all()
+            start_date, end_date = time_period or (None, None)
+            return AuditDailyCount.summarize(storage.session, start_date, end_date)
         except SQLAlchemyError as e:
             logging.error(f"Error generating summary: {e}")
             raise
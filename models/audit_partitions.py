@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+"""
+monthly partitioning, retention && archival for the audit log table.
+
+on MySQL audit_logs is RANGE partitioned by month on `timestamp`, so
+date_range filters only touch the partitions they overlap. months older
+than the retention window are moved to gzipped NDJSON archives, one per
+month, and their emptied partitions dropped; fetch_logs can still read
+those archives.
+
+usage:
+    python audit_partitions.py enable
+    python audit_partitions.py maintain --retain-months 12
+"""
+import argparse
+import gzip
+import heapq
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from operator import itemgetter
+from sqlalchemy import MetaData, delete, inspect, select, text, update
+from streaming import keyset_pages
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', 'logs/archive')
+ARCHIVE_PATTERN = re.compile(r'audit_logs_(\d{4})_(\d{2})(\.\d+)?\.ndjson\.gz$')
+ARCHIVE_FIELDS = [
+        'log_id', 'user_id', 'action_type', 'entity_type', 'entity_id',
+        'timestamp', 'details', 'ip_address', 'status', 'batch_id'
+        ]
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _partition_clause(month: datetime) -> str:
+    return (f"PARTITION {partition_name(month)} VALUES LESS THAN "
+            f"(TO_DAYS('{add_months(month, 1):%Y-%m-%d}'))")
+
+
+def _is_mysql(session) -> bool:
+    return session.get_bind().dialect.name == 'mysql'
+
+
+def list_partitions(session) -> list:
+    """
+    function definition that returns the monthly partitions (oldest first)
+    """
+    if not _is_mysql(session):
+        return []
+    rows = session.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'audit_logs' "
+        "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"))
+    return [datetime.strptime(name[1:], '%Y%m') for (name,) in rows if name != 'pmax']
+
+
+def enable_partitioning(session, months_ahead: int = 3):
+    """
+    function definition that converts audit_logs to monthly RANGE
+    partitions. MySQL needs the partition column in the primary key
+    and does not allow FULLTEXT indexes on partitioned tables, so the
+    key becomes (log_id, timestamp) and search switches to the token index
+    """
+    import audit_search
+
+    if not _is_mysql(session):
+        raise NotImplementedError("Audit log partitioning is only supported on MySQL")
+    if list_partitions(session):
+        return
+
+    oldest = session.execute(text("SELECT MIN(timestamp) FROM audit_logs")).scalar()
+    first = month_start(oldest or datetime.now())
+    last = add_months(month_start(datetime.now()), months_ahead)
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+
+    if audit_search.uses_fulltext(session):
+        audit_search.rebuild_index(session)
+        session.execute(text("ALTER TABLE audit_logs DROP INDEX ft_audit_logs_details"))
+    session.execute(text(
+        "ALTER TABLE audit_logs DROP PRIMARY KEY, ADD PRIMARY KEY (log_id, timestamp)"))
+    session.execute(text(
+        "ALTER TABLE audit_logs PARTITION BY RANGE (TO_DAYS(timestamp)) ("
+        + ', '.join(_partition_clause(month) for month in months)
+        + ", PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+    session.commit()
+
+
+def ensure_future_partitions(session, months_ahead: int = 3):
+    """
+    function definition that splits pmax so partitions exist
+    for the coming `months_ahead` months
+    """
+    partitions = list_partitions(session)
+    if not partitions:
+        return
+    target = add_months(month_start(datetime.now()), months_ahead)
+    months = []
+    month = add_months(partitions[-1], 1)
+    while month <= target:
+        months.append(month)
+        month = add_months(month, 1)
+    if months:
+        session.execute(text(
+            "ALTER TABLE audit_logs REORGANIZE PARTITION pmax INTO ("
+            + ', '.join(_partition_clause(month) for month in months)
+            + ", PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+        session.commit()
+
+
+def archive_path(month: datetime, archive_dir: str = None) -> str:
+    """
+    function definition for the archive file of a month
+    """
+    return os.path.join(archive_dir or ARCHIVE_DIR, f"audit_logs_{month:%Y_%m}.ndjson.gz")
+
+
+def month_archives(archive_dir: str = None) -> dict:
+    """
+    function definition that maps each archived month to its files.
+    a month has one file, unless a run stopped before merging
+    the numbered part files older runs left behind
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    months = {}
+    if not os.path.isdir(archive_dir):
+        return months
+    for name in sorted(os.listdir(archive_dir)):
+        match = ARCHIVE_PATTERN.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1)
+            months.setdefault(month, []).append(os.path.join(archive_dir, name))
+    return months
+
+
+def _archive_records(path: str):
+    with gzip.open(path, 'rt') as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def _unique_records(streams):
+    """
+    function definition that merges record streams sorted by log_id,
+    keeping one record per log_id
+    """
+    last = None
+    for record in heapq.merge(*streams, key=itemgetter('log_id')):
+        if record['log_id'] != last:
+            last = record['log_id']
+            yield record
+
+
+def _write_archive(month: datetime, archive_dir: str, rows) -> int:
+    """
+    function definition that merges rows (in log_id order) into the
+    month's archive by log_id, replacing it atomically and removing
+    the part files older runs left behind. returns the rows merged in
+    """
+    path = archive_path(month, archive_dir)
+    existing = month_archives(os.path.dirname(path)).get(month, [])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    count = 0
+
+    def live_records():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield dict(row._mapping, timestamp=row.timestamp.isoformat())
+
+    with gzip.open(f"{path}.tmp", 'wt') as archive:
+        for record in _unique_records([_archive_records(part) for part in existing] + [live_records()]):
+            archive.write(json.dumps(record) + '\n')
+    os.replace(f"{path}.tmp", path)
+    for part in existing:
+        if part != path:
+            os.remove(part)
+    return count
+
+
+def _forget_daily_counts(session, month: datetime):
+    from audit_summary import AuditDailyCount
+
+    session.execute(delete(AuditDailyCount).where(
+        AuditDailyCount.day >= month.date(), AuditDailyCount.day < add_months(month, 1).date()))
+
+
+def _archive_partition(session, month: datetime, archive_dir: str, batch_size: int) -> int:
+    """
+    function definition that swaps the month's partition for an empty
+    staging table (EXCHANGE PARTITION is a metadata change), archives
+    the staging table, then drops it and the partition. rows that land
+    in the partition meanwhile stay there for the next run. a run that
+    stopped after the exchange resumes from the staging table
+    """
+    from audit_chain import AuditLogBatch
+    from audit_logs import AuditLog
+    from audit_search import AuditLogToken
+
+    name = partition_name(month)
+    stage = AuditLog.__table__.to_metadata(MetaData(), name=f"audit_logs_archive_{name}")
+    if not inspect(session.connection()).has_table(stage.name):
+        session.execute(text(f"CREATE TABLE {stage.name} LIKE audit_logs"))
+        session.execute(text(f"ALTER TABLE {stage.name} REMOVE PARTITIONING"))
+        session.execute(text(f"ALTER TABLE audit_logs EXCHANGE PARTITION {name} WITH TABLE {stage.name}"))
+
+    query = session.query(*[stage.c[field] for field in ARCHIVE_FIELDS])
+    count = _write_archive(month, archive_dir, keyset_pages(query, stage.c.log_id, batch_size))
+
+    session.execute(delete(AuditLogToken).where(AuditLogToken.log_id.in_(select(stage.c.log_id))))
+    session.execute(update(AuditLogBatch)
+            .where(AuditLogBatch.batch_id.in_(select(stage.c.batch_id).where(stage.c.batch_id.isnot(None))))
+            .values(archived=True))
+    _forget_daily_counts(session, month)
+    session.commit()
+
+    session.execute(text(f"DROP TABLE {stage.name}"))
+    if session.execute(text(f"SELECT 1 FROM audit_logs PARTITION ({name}) LIMIT 1")).first() is None:
+        session.execute(text(f"ALTER TABLE audit_logs DROP PARTITION {name}"))
+    session.commit()
+    return count
+
+
+def _archive_rows(session, month: datetime, archive_dir: str, batch_size: int) -> int:
+    """
+    function definition for unpartitioned tables: archives the month's
+    rows, then deletes those up to the last archived log_id in chunks,
+    one transaction each, so rows inserted meanwhile stay
+    """
+    from audit_chain import mark_archived
+    from audit_logs import AuditLog
+    from audit_search import AuditLogToken
+
+    in_month = (AuditLog.timestamp >= month, AuditLog.timestamp < add_months(month, 1))
+    query = session.query(*[getattr(AuditLog, field) for field in ARCHIVE_FIELDS]).filter(*in_month)
+    last_id = None
+
+    def tracked(rows):
+        nonlocal last_id
+        for row in rows:
+            last_id = row.log_id
+            yield row
+
+    count = _write_archive(month, archive_dir, tracked(keyset_pages(query, AuditLog.log_id, batch_size)))
+
+    while last_id is not None:
+        page = (session.query(AuditLog.log_id, AuditLog.batch_id)
+                .filter(*in_month, AuditLog.log_id <= last_id)
+                .order_by(AuditLog.log_id).limit(batch_size).all())
+        if not page:
+            break
+        log_ids = [row.log_id for row in page]
+        session.execute(delete(AuditLogToken).where(AuditLogToken.log_id.in_(log_ids)))
+        session.execute(delete(AuditLog).where(AuditLog.log_id.in_(log_ids)))
+        mark_archived(session, {row.batch_id for row in page if row.batch_id})
+        session.commit()
+    _forget_daily_counts(session, month)
+    session.commit()
+    return count
+
+
+def archive_month(session, month: datetime, archive_dir: str = None, batch_size: int = 5000) -> int:
+    """
+    function definition that moves one month of logs into its gzipped
+    NDJSON archive and removes them from the live table together with
+    their search postings and daily counters; their chain batches keep
+    only their links. the month's existing archive is merged in by
+    log_id, so re-running after a crash never archives a row twice.
+    a partitioned month is swapped out and dropped whole; otherwise
+    rows are deleted in chunks. returns the rows archived
+    """
+    if month in list_partitions(session):
+        return _archive_partition(session, month, archive_dir, batch_size)
+    return _archive_rows(session, month, archive_dir, batch_size)
+
+
+def apply_retention(session, retain_months: int = 12, archive_dir: str = None) -> dict:
+    """
+    function definition for the retention job: every month older than
+    the retention window is archived and removed from the live table
+    """
+    from audit_logs import AuditLog
+
+    cutoff = add_months(month_start(datetime.now()), -retain_months)
+    oldest = session.query(AuditLog.timestamp).order_by(AuditLog.timestamp).limit(1).scalar()
+    archived = {}
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        archived[f"{month:%Y-%m}"] = archive_month(session, month, archive_dir)
+        month = add_months(month, 1)
+    return archived
+
+
+def read_archives(start: datetime, end: datetime, archive_dir: str = None, **filters):
+    """
+    function definition that yields archived log dicts whose timestamp
+    falls in [start, end] and whose fields equal the given filters.
+    only the archive files for overlapping months are opened
+    """
+    filters = {key: value for key, value in filters.items() if value is not None}
+    for month, paths in sorted(month_archives(archive_dir).items()):
+        if add_months(month, 1) <= start or month > end:
+            continue
+        for record in _unique_records([_archive_records(path) for path in paths]):
+            record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+            if not start <= record['timestamp'] <= end:
+                continue
+            if all(str(record.get(key)) == str(value) for key, value in filters.items()):
+                yield record
+
+
+if __name__ == "__main__":
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description='Manage audit log partitions')
+    parser.add_argument('command', choices=['enable', 'maintain'])
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--retain-months', type=int, default=12)
+    args = parser.parse_args()
+
+    session = Storage().session
+    if args.command == 'enable':
+        enable_partitioning(session, args.months_ahead)
+    else:
+        ensure_future_partitions(session, args.months_ahead)
+        print(json.dumps(apply_retention(session, args.retain_months), indent=4))
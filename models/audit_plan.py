@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+query planner report for the audit log filters.
+it runs EXPLAIN on the keyset page query of every combination of
+fetch_logs/filter_logs filters and flags any that full-scan audit_logs
+
+usage:
+    python audit_plan.py explain
+    python audit_plan.py create-indexes
+"""
+import argparse
+import re
+import sys
+from datetime import datetime
+from itertools import combinations
+from sqlalchemy import inspect, text
+
+FILTER_VALUES = {
+        'user_id': 1,
+        'entity_type': 'task',
+        'status': 'success',
+        'action_type': 'create',
+        'date_range': (datetime(2024, 1, 1), datetime(2024, 1, 31)),
+        }
+
+
+def filter_combinations() -> list:
+    """
+    function definition for every subset of the supported filters
+    """
+    names = list(FILTER_VALUES)
+    return [combo for size in range(len(names) + 1) for combo in combinations(names, size)]
+
+
+def _plan(session, sql: str) -> tuple:
+    """
+    function definition that returns (plan lines, full_scan) for a query
+        *mysql -> `type: ALL` on audit_logs
+        *sqlite -> a bare `SCAN audit_logs` without an index
+        *postgresql -> `Seq Scan on audit_logs`
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        rows = [row._mapping for row in session.execute(text(f"EXPLAIN {sql}"))]
+        lines = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']}" for row in rows]
+        return lines, any(row['table'] == 'audit_logs' and row['type'] == 'ALL' for row in rows)
+    if dialect == 'sqlite':
+        lines = [row.detail for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        return lines, any(re.fullmatch(r'SCAN (TABLE )?audit_logs', line) for line in lines)
+    if dialect == 'postgresql':
+        lines = [row[0] for row in session.execute(text(f"EXPLAIN {sql}"))]
+        return lines, any('Seq Scan on audit_logs' in line for line in lines)
+    raise NotImplementedError(f"Query plans are not supported on {dialect}")
+
+
+def explain(session, limit: int = 100) -> list:
+    """
+    function definition that explains the page query of every filter
+    combination and returns one report dict per combination
+    """
+    from audit_logs import AuditLog
+
+    dialect = session.get_bind().dialect
+    report = []
+    for combo in filter_combinations():
+        filters = {name: FILTER_VALUES[name] for name in combo}
+        query = AuditLog.page_query(limit=limit, **filters)
+        sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        lines, full_scan = _plan(session, sql)
+        report.append({'filters': list(combo), 'full_scan': full_scan, 'plan': lines})
+    return report
+
+
+def create_indexes(session) -> list:
+    """
+    function definition that creates the declared composite indexes
+    missing from an existing audit_logs table
+    """
+    from audit_logs import AuditLog
+
+    bind = session.get_bind()
+    existing = {index['name'] for index in inspect(bind).get_indexes('audit_logs')}
+    created = []
+    for index in AuditLog.__table__.indexes:
+        if index.name.startswith('ix_') and index.name not in existing:
+            index.create(bind)
+            created.append(index.name)
+    return created
+
+
+if __name__ == "__main__":
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description='Audit log query plan report')
+    parser.add_argument('command', choices=['explain', 'create-indexes'])
+    args = parser.parse_args()
+
+    session = Storage().session
+    if args.command == 'create-indexes':
+        print('\n'.join(create_indexes(session)))
+        sys.exit(0)
+
+    flagged = 0
+    for entry in explain(session):
+        label = ', '.join(entry['filters']) or '(no filters)'
+        status = 'FULL SCAN' if entry['full_scan'] else 'ok'
+        flagged += entry['full_scan']
+        print(f"{status:<10}{label}")
+        for line in entry['plan']:
+            print(f"{'':<10}{line}")
+    print(f"{flagged} of {len(filter_combinations())} filter combinations fall back to full scans")
+    sys.exit(1 if flagged else 0)
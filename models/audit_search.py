@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+full-text search over audit log details.
+unpartitioned MySQL tables use a FULLTEXT index on audit_logs.details;
+everything else uses the audit_log_tokens inverted index
+maintained on every insert
+"""
+import re
+from sqlalchemy import Column, Integer, String, delete, func, insert, select, text
+from sqlalchemy.dialects.mysql import match
+from streaming import keyset_pages
+from user import Base
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,64}')
+
+
+def tokenize(value) -> set:
+    """
+    function definition that splits text into lowercase search tokens
+    """
+    if not value:
+        return set()
+    return set(TOKEN_PATTERN.findall(str(value).lower()))
+
+
+class AuditLogToken(Base):
+    """
+    class definition for one (token, log) posting of the inverted index
+    """
+    __tablename__ = 'audit_log_tokens'
+
+    token = Column(String(64), primary_key=True)
+    log_id = Column(Integer, primary_key=True, index=True)
+
+
+def uses_fulltext(session) -> bool:
+    """
+    function definition that tells whether the FULLTEXT index exists.
+    it is MySQL only, and dropped when the table is partitioned
+    since partitioned InnoDB tables cannot carry FULLTEXT indexes.
+    it is looked up on every call (one indexed information_schema
+    read) because another process may drop it at any time
+    """
+    if session.get_bind().dialect.name != 'mysql':
+        return False
+    return session.execute(text(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = 'audit_logs' "
+        "AND index_name = 'ft_audit_logs_details' LIMIT 1")).first() is not None
+
+
+def index_rows(session, rows):
+    """
+    function definition that adds postings for (log_id, details) pairs.
+    the caller commits, so postings land in the same transaction
+    """
+    postings = [
+            {'token': token, 'log_id': log_id}
+            for log_id, details in rows
+            for token in tokenize(details)
+            ]
+    if postings:
+        session.execute(insert(AuditLogToken), postings)
+
+
+def rebuild_index(session, batch_size: int = 5000):
+    """
+    function definition that rebuilds the token index from scratch,
+    e.g for logs written before the index existed
+    """
+    from audit_logs import AuditLog
+
+    session.execute(delete(AuditLogToken))
+    query = session.query(AuditLog.log_id, AuditLog.details)
+    batch = []
+    for row in keyset_pages(query, AuditLog.log_id, batch_size):
+        batch.append((row.log_id, row.details))
+        if len(batch) >= batch_size:
+            index_rows(session, batch)
+            batch = []
+    index_rows(session, batch)
+    session.commit()
+
+
+def search(session, keywords: str, mode: str = 'and', limit: int = 50, offset: int = 0):
+    """
+    function definition that returns ranked AuditLog rows matching
+    all (mode='and') or any (mode='or') of the keywords
+    """
+    if mode not in ('and', 'or'):
+        raise ValueError("mode must be 'and' or 'or'")
+    terms = sorted(tokenize(keywords))
+    if not terms:
+        return []
+    return search_query(session, terms, mode, uses_fulltext(session), limit, offset).all()
+
+
+def search_query(session, terms: list, mode: str, fulltext: bool, limit: int = 50, offset: int = 0):
+    """
+    function definition for the ranked query behind search, either
+    MATCH ... AGAINST on the FULLTEXT index or a join on the token index
+    """
+    from audit_logs import AuditLog
+
+    if fulltext:
+        expression = ' '.join(('+' if mode == 'and' else '') + term for term in terms)
+        score = match(AuditLog.details, against=expression).in_boolean_mode()
+        return (session.query(AuditLog)
+                .filter(score)
+                .order_by(score.desc(), AuditLog.log_id.desc())
+                .limit(limit).offset(offset))
+
+    matches = func.count(AuditLogToken.token).label('matches')
+    ranked = (select(AuditLogToken.log_id, matches)
+            .where(AuditLogToken.token.in_(terms))
+            .group_by(AuditLogToken.log_id))
+    if mode == 'and':
+        ranked = ranked.having(matches == len(terms))
+    ranked = ranked.subquery()
+
+    return (session.query(AuditLog)
+            .join(ranked, ranked.c.log_id == AuditLog.log_id)
+            .order_by(ranked.c.matches.desc(), AuditLog.log_id.desc())
+            .limit(limit).offset(offset))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+per-day audit log counters by (action_type, entity_type, status),
+maintained on write so summaries never scan whole months of logs
+"""
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Date, Integer, String, delete, func
+from streaming import keyset_pages
+from upserts import upsert
+from user import Base
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+def day_start(timestamp: datetime) -> datetime:
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+class AuditDailyCount(Base):
+    """
+    class definition for how many logs of one
+    (action_type, entity_type, status) were written on one day
+    """
+    __tablename__ = 'audit_daily_counts'
+
+    day = Column(Date, primary_key=True)
+    action_type = Column(String(20), primary_key=True)
+    entity_type = Column(String(20), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    @staticmethod
+    def aggregate(rows) -> list:
+        """
+        method definition that folds audit row dicts into counter rows
+        """
+        counts = Counter(
+                (row['timestamp'].date(), row['action_type'], row['entity_type'], row.get('status') or 'success')
+                for row in rows
+                )
+        return [
+                {'day': day, 'action_type': action_type, 'entity_type': entity_type,
+                    'status': status, 'count': count}
+                for (day, action_type, entity_type, status), count in counts.items()
+                ]
+
+    @staticmethod
+    def apply(session, rows):
+        """
+        method definition that adds new audit rows to the counters
+        with one multi-row upsert. the caller commits, so counters
+        land in the same transaction as the logs
+        """
+        table = AuditDailyCount.__table__
+        upsert(session, table, AuditDailyCount.aggregate(rows),
+                ['day', 'action_type', 'entity_type', 'status'],
+                lambda new: {'count': table.c.count + new.count})
+
+    @staticmethod
+    def rebuild(session, start=None, end=None, batch_size: int = 10000):
+        """
+        method definition that recounts every day touched by [start, end)
+        from raw logs (the whole table when no range is given),
+        e.g for logs written before the counters existed
+        """
+        from audit_logs import AuditLog
+
+        try:
+            query = session.query(AuditLog.log_id, AuditLog.timestamp, AuditLog.action_type,
+                    AuditLog.entity_type, AuditLog.status)
+            purge = delete(AuditDailyCount)
+            if start is not None:
+                start = day_start(start)
+                query = query.filter(AuditLog.timestamp >= start)
+                purge = purge.where(AuditDailyCount.day >= start.date())
+            if end is not None:
+                end = day_start(end) + timedelta(days=1)
+                query = query.filter(AuditLog.timestamp < end)
+                purge = purge.where(AuditDailyCount.day < end.date())
+            session.execute(purge)
+
+            batch = []
+            for row in keyset_pages(query, AuditLog.log_id, batch_size):
+                batch.append(row._mapping)
+                if len(batch) >= batch_size:
+                    AuditDailyCount.apply(session, batch)
+                    batch = []
+            AuditDailyCount.apply(session, batch)
+            session.commit()
+        except Exception as e:
+            logger.error(f"Failed to rebuild audit counters: {e}")
+            session.rollback()
+            raise
+
+    @staticmethod
+    def summarize(session, start=None, end=None) -> list:
+        """
+        method definition that counts logs per action_type in [start, end].
+        whole days are summed from the counters; only the partial
+        edge days are counted from the raw audit table
+        """
+        from audit_logs import AuditLog
+
+        totals = Counter()
+        counters = session.query(AuditDailyCount.action_type, func.sum(AuditDailyCount.count))
+        if start is None or end is None:
+            totals.update(dict(counters.group_by(AuditDailyCount.action_type).all()))
+            return sorted((action_type, int(count)) for action_type, count in totals.items() if count)
+
+        first_day = day_start(start)
+        if first_day < start:
+            first_day += timedelta(days=1)
+        last_day = day_start(end)
+
+        edges = [(AuditLog.timestamp >= start) & (AuditLog.timestamp <= end)]
+        if first_day < last_day:
+            counters = counters.filter(
+                    AuditDailyCount.day >= first_day.date(), AuditDailyCount.day < last_day.date())
+            totals.update(dict(counters.group_by(AuditDailyCount.action_type).all()))
+            edges = [
+                    (AuditLog.timestamp >= start) & (AuditLog.timestamp < first_day),
+                    (AuditLog.timestamp >= last_day) & (AuditLog.timestamp <= end),
+                    ]
+
+        for edge in edges:
+            query = session.query(AuditLog.action_type, func.count(AuditLog.log_id)).filter(edge)
+            totals.update(dict(query.group_by(AuditLog.action_type).all()))
+
+        return sorted((action_type, int(count)) for action_type, count in totals.items() if count)
+
+
+if __name__ == "__main__":
+    from storage import Storage
+
+    AuditDailyCount.rebuild(Storage().session)
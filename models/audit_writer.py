@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+background writer that takes audit logging out of the request path
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from spill import SpillFile
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+_STOP = object()
+
+
+class AuditWriter:
+    """
+    class definition for a bounded queue of audit rows drained by one
+    worker thread that writes them in batches with `write_batch`.
+    rows that cannot reach the database (DB down, or queue full) are
+    appended to a local spill file and replayed after the next
+    successful flush, so every entry is written at least once
+    """
+    def __init__(self, write_batch, max_queue: int = 10000, batch_size: int = 500,
+            flush_interval: float = 1.0, spill_path: str = 'logs/audit_spill.ndjson'):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_file = SpillFile(spill_path, batch_size)
+        self._thread = None
+        self.written = 0
+        self.spilled = 0
+        self.failed_flushes = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def submit(self, row: dict):
+        """
+        method definition that queues a row without blocking.
+        when the queue is full the row goes straight to the spill file
+        """
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._spill([row])
+
+    def metrics(self) -> dict:
+        return {
+                'queue_depth': self._queue.qsize(),
+                'written': self.written,
+                'spilled': self.spilled,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'last_flush_ms': round(self.last_flush_seconds * 1000, 3),
+                'avg_flush_ms': round(self.total_flush_seconds / self.flushes * 1000, 3) if self.flushes else 0.0,
+                }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list) -> bool:
+        started = time.perf_counter()
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} audit logs, spilling to disk: {e}")
+            self.failed_flushes += 1
+            self._spill(batch)
+            return False
+        finally:
+            self.last_flush_seconds = time.perf_counter() - started
+            self.total_flush_seconds += self.last_flush_seconds
+            self.flushes += 1
+
+        self.written += len(batch)
+        self._replay_spill()
+        return True
+
+    def _spill(self, rows: list):
+        self._spill_file.append(rows)
+        self.spilled += len(rows)
+
+    def _write_replayed(self, batch: list):
+        self.write_batch(batch)
+        self.written += len(batch)
+
+    def _replay_spill(self):
+        """
+        method definition that writes spilled rows back to the database
+        """
+        try:
+            self._spill_file.replay(self._write_replayed)
+        except Exception as e:
+            logger.error(f"Failed to replay spilled audit logs: {e}")
+
+    def close(self):
+        """
+        method definition that drains the queue before shutdown
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
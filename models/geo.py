@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+geohash cell keys, bounding boxes && haversine distance
+used by the location spatial index
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 9) -> str:
+    """
+    function definition that encodes a point as a geohash string.
+    points sharing a prefix share the cell that prefix names
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        span, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (span[0] + span[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            span[0] = middle
+        else:
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision: int) -> tuple:
+    """
+    function definition for the (height, width) in degrees
+    of a geohash cell at a precision
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    function definition for the great-circle distance between two points
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> tuple:
+    """
+    function definition for the (min_lat, max_lat, min_lon, max_lon)
+    box that contains every point within radius_km. longitudes may
+    fall outside [-180, 180] when the box crosses the antimeridian
+    """
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = latitude - d_lat, latitude + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    d_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    return min_lat, max_lat, longitude - d_lon, longitude + d_lon
+
+
+def longitude_ranges(min_lon: float, max_lon: float) -> list:
+    """
+    function definition that splits a longitude span crossing
+    the antimeridian into ranges inside [-180, 180]
+    """
+    if max_lon - min_lon >= 360:
+        return [(-180.0, 180.0)]
+    if min_lon < -180:
+        return [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return [(min_lon, max_lon)]
+
+
+def covering_cells(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> set:
+    """
+    function definition for the geohash prefixes covering a box. the
+    precision is the finest whose cells are at least as large as the
+    box, so its corners name every cell it touches (at most four
+    per longitude range)
+    """
+    height = max_lat - min_lat
+    width = max_lon - min_lon
+    precision = 0
+    while precision < MAX_PRECISION:
+        cell_height, cell_width = cell_size(precision + 1)
+        if cell_height < height or cell_width < width:
+            break
+        precision += 1
+    if precision == 0:
+        return {''}
+
+    cells = set()
+    for low, high in longitude_ranges(min_lon, max_lon):
+        for latitude in (min_lat, max_lat):
+            for longitude in (low, high):
+                cells.add(geohash_encode(latitude, longitude, precision))
+    return cells
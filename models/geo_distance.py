@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+batch haversine distances: one point against many (a tasker against
+every candidate task) and many against many (matching batches).
+numpy is used when installed, with a pure-Python fallback
+
+usage:
+    python geo_distance.py --points 10000 100000 1000000
+    python geo_distance.py --points 10000 100000 --pure-python
+"""
+import argparse
+import math
+import random
+import time
+from geo import EARTH_RADIUS_KM, haversine_km
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def distances(latitude: float, longitude: float, lats, lons):
+    """
+    function definition for the km distances from one point
+    to every (lats[i], lons[i]). returns an array with numpy,
+    a list otherwise
+    """
+    if np is None:
+        return [haversine_km(latitude, longitude, lat, lon) for lat, lon in zip(lats, lons)]
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    phi = math.radians(latitude)
+    a = (np.sin((lats - phi) / 2) ** 2
+            + math.cos(phi) * np.cos(lats) * np.sin((lons - math.radians(longitude)) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distance_matrix(lats1, lons1, lats2, lons2):
+    """
+    function definition for the (len(lats1), len(lats2)) matrix of km
+    distances between two sets of points. returns an array with numpy,
+    a list of rows otherwise
+    """
+    if np is None:
+        return [distances(lat, lon, lats2, lons2) for lat, lon in zip(lats1, lons1)]
+
+    lats1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lons1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, None]
+    lats2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lons2 = np.radians(np.asarray(lons2, dtype=np.float64))[None, :]
+    a = (np.sin((lats2 - lats1) / 2) ** 2
+            + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def within_radius(latitude: float, longitude: float, lats, lons, radius: float, limit: int = None) -> list:
+    """
+    function definition for the (index, distance_km) pairs of points
+    within radius km, nearest first, at most `limit` of them
+    """
+    found = distances(latitude, longitude, lats, lons)
+    if np is None:
+        hits = sorted(((i, d) for i, d in enumerate(found) if d <= radius), key=lambda hit: hit[1])
+        return hits[:limit] if limit is not None else hits
+
+    indices = np.flatnonzero(found <= radius)
+    if limit is not None and len(indices) > limit:
+        indices = indices[np.argpartition(found[indices], limit - 1)[:limit]]
+    indices = indices[np.argsort(found[indices], kind='stable')]
+    return list(zip(indices.tolist(), found[indices].tolist()))
+
+
+def benchmark(sizes, queries: int = 20, radius: float = 18.0) -> list:
+    """
+    function definition that times one-to-many distance queries
+    over uniformly spread points around Nairobi
+    """
+    rng = random.Random(0)
+    results = []
+    for size in sizes:
+        lats = [rng.uniform(-4.7, 4.6) for _ in range(size)]
+        lons = [rng.uniform(33.9, 41.9) for _ in range(size)]
+        if np is not None:
+            lats, lons = np.array(lats), np.array(lons)
+        started = time.perf_counter()
+        for _ in range(queries):
+            hits = within_radius(-1.29, 36.82, lats, lons, radius, 50)
+        results.append({
+            'points': size,
+            'backend': 'numpy' if np is not None else 'python',
+            'ms_per_query': round((time.perf_counter() - started) / queries * 1000, 3),
+            'hits': len(hits),
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark batch haversine distances')
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--pure-python', action='store_true', help='time the fallback without numpy')
+    args = parser.parse_args()
+    if args.pure_python:
+        np = None
+
+    for result in benchmark(args.points, args.queries):
+        print(f"{result['points']:>9} points  {result['backend']:<7}{result['ms_per_query']:>10.3f} ms/query")
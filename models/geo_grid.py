@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+"""
+in-process uniform grid of open tasks for nearby-task queries.
+coordinates live in compact float arrays bucketed by grid cell,
+so radius && k-nearest queries never touch the database or the ORM
+"""
+import logging
+import math
+import threading
+from array import array
+from storage import Storage
+from sqlalchemy import or_
+from geo import bounding_box, longitude_ranges
+from geo_distance import np, within_radius
+from lazy import LazyObject
+from sessions import background_session
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+storage = LazyObject(Storage)
+
+
+def is_open(status, assigned_tasker_id) -> bool:
+    """
+    function definition for whether a task can still be picked up.
+    tasks created without a status are pending
+    """
+    from tasks import TaskStatusEnum
+
+    return assigned_tasker_id is None and status in (None, TaskStatusEnum.PENDING)
+
+
+class TaskGrid:
+    """
+    class definition for a grid of `cell_degrees` cells over the open
+    tasks. slot i of the lats/lons/ids arrays holds one task; each
+    cell keeps the slots inside it, and a query measures the slots
+    of the cells it covers in one vectorized pass. every worker
+    process holds its own grid, kept in step by the task routes it
+    serves and fully rebuilt every `rebuild_interval` seconds, so a
+    change made through another worker shows up here within that
+    interval; readers re-check that the tasks they serve are open.
+    changes made while a rebuild is reading are queued and replayed
+    onto the fresh arrays before they are swapped in
+    """
+    def __init__(self, cell_degrees: float = 0.1, rebuild_interval: float = 60.0):
+        self.cell_degrees = cell_degrees
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = None
+        self._lats, self._lons, self._ids, self._slots, self._cells = self._empty()
+        self._pending = None
+        self.rebuilds = 0
+
+    @staticmethod
+    def _empty():
+        return array('d'), array('d'), array('q'), {}, {}
+
+    def _cell(self, latitude: float, longitude: float) -> tuple:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def start(self):
+        """
+        method definition that builds the grid and starts
+        the periodic rebuild thread, which reads through a session of its own
+        """
+        if self._session is None:
+            self._session = background_session(storage)
+        self.rebuild(self._session)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='task-grid-rebuild', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.rebuild_interval):
+            try:
+                self.rebuild(self._session)
+            except Exception as e:
+                logger.error(f"Failed to rebuild task grid: {e}")
+
+    def rebuild(self, session):
+        """
+        method definition that reloads every open task with a location
+        into fresh arrays, then swaps them in
+        """
+        from locations import Location
+        from tasks import Task, TaskStatusEnum
+
+        with self._lock:
+            self._pending = []
+        try:
+            rows = (session.query(Task.id, Location.latitude, Location.longitude)
+                    .join(Location, Task.location_id == Location.id)
+                    .filter(Task.assigned_tasker_id.is_(None),
+                        or_(Task.status.is_(None), Task.status == TaskStatusEnum.PENDING))
+                    .yield_per(10000))
+            lats, lons, ids, slots, cells = self._empty()
+            for task_id, latitude, longitude in rows:
+                slots[task_id] = len(ids)
+                cells.setdefault(self._cell(latitude, longitude), []).append(len(ids))
+                lats.append(latitude)
+                lons.append(longitude)
+                ids.append(task_id)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        finally:
+            session.rollback()
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._lats, self._lons, self._ids, self._slots, self._cells = lats, lons, ids, slots, cells
+            for change, args in pending:
+                change(*args)
+            self.rebuilds += 1
+
+    def _record(self, change, *args):
+        """
+        method definition that applies a change to the live arrays and,
+        while a rebuild is running, queues it for the fresh ones.
+        the caller holds the lock
+        """
+        change(*args)
+        if self._pending is not None:
+            self._pending.append((change, args))
+
+    def upsert(self, task_id: int, latitude: float, longitude: float):
+        """
+        method definition that adds a task or moves it to new coordinates
+        """
+        with self._lock:
+            self._record(self._upsert, task_id, latitude, longitude)
+
+    def _upsert(self, task_id: int, latitude: float, longitude: float):
+        slot = self._slots.get(task_id)
+        if slot is not None:
+            self._cells[self._cell(self._lats[slot], self._lons[slot])].remove(slot)
+            self._lats[slot] = latitude
+            self._lons[slot] = longitude
+        else:
+            slot = self._slots[task_id] = len(self._ids)
+            self._lats.append(latitude)
+            self._lons.append(longitude)
+            self._ids.append(task_id)
+        self._cells.setdefault(self._cell(latitude, longitude), []).append(slot)
+
+    def remove(self, task_id: int):
+        """
+        method definition that drops a task. the last slot is moved
+        into the freed one so the arrays stay dense
+        """
+        with self._lock:
+            self._record(self._remove, task_id)
+
+    def _remove(self, task_id: int):
+        slot = self._slots.pop(task_id, None)
+        if slot is None:
+            return
+        cell = self._cell(self._lats[slot], self._lons[slot])
+        self._cells[cell].remove(slot)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+        last = len(self._ids) - 1
+        if slot != last:
+            moved_cell = self._cell(self._lats[last], self._lons[last])
+            members = self._cells[moved_cell]
+            members[members.index(last)] = slot
+            self._lats[slot] = self._lats[last]
+            self._lons[slot] = self._lons[last]
+            self._ids[slot] = self._ids[last]
+            self._slots[self._ids[slot]] = slot
+        del self._lats[last]
+        del self._lons[last]
+        del self._ids[last]
+
+    def sync_task(self, session, task):
+        """
+        method definition that mirrors a task's current state:
+        open tasks with a location are (re)placed, others dropped
+        """
+        from locations import Location
+
+        if task.location_id is None or not is_open(task.status, task.assigned_tasker_id):
+            self.remove(task.id)
+            return
+        point = session.query(Location.latitude, Location.longitude).filter(
+                Location.id == task.location_id).first()
+        if point is None:
+            self.remove(task.id)
+        else:
+            self.upsert(task.id, point.latitude, point.longitude)
+
+    def sync_location(self, session, location_id: int):
+        """
+        method definition that re-places the open tasks at a location
+        after its coordinates change
+        """
+        self.sync_locations(session, [location_id])
+
+    def sync_locations(self, session, location_ids, batch_size: int = 1000):
+        """
+        method definition that re-places the open tasks at many moved
+        locations, one query per `batch_size` locations
+        """
+        from locations import Location
+        from tasks import Task
+
+        location_ids = list(location_ids)
+        for i in range(0, len(location_ids), batch_size):
+            rows = (session.query(Task.id, Location.latitude, Location.longitude)
+                    .join(Location, Task.location_id == Location.id)
+                    .filter(Location.id.in_(location_ids[i:i + batch_size])).all())
+            with self._lock:
+                for task_id, latitude, longitude in rows:
+                    if task_id in self._slots:
+                        self._record(self._upsert, task_id, latitude, longitude)
+
+    def within(self, latitude: float, longitude: float, radius: float, limit: int = 50) -> list:
+        """
+        method definition that returns (task_id, latitude, longitude,
+        distance_km) of open tasks within radius km, nearest first
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+        size = self.cell_degrees
+        slots = []
+        with self._lock:
+            lats, lons, ids, cells = self._lats, self._lons, self._ids, self._cells
+            rows = range(math.floor(min_lat / size), math.floor(max_lat / size) + 1)
+            for low, high in longitude_ranges(min_lon, max_lon):
+                columns = range(math.floor(low / size), math.floor(high / size) + 1)
+                if len(rows) * len(columns) > len(cells):
+                    keys = [key for key in cells if key[0] in rows and key[1] in columns]
+                else:
+                    keys = [(row, column) for row in rows for column in columns]
+                for key in keys:
+                    slots.extend(cells.get(key, ()))
+            if np is not None:
+                slots = np.array(slots, dtype=np.int64)
+                candidate_lats = np.frombuffer(lats, dtype=np.float64)[slots]
+                candidate_lons = np.frombuffer(lons, dtype=np.float64)[slots]
+            else:
+                candidate_lats = [lats[slot] for slot in slots]
+                candidate_lons = [lons[slot] for slot in slots]
+            hits = within_radius(latitude, longitude, candidate_lats, candidate_lons, radius, limit)
+            return [(ids[int(slots[index])], float(candidate_lats[index]), float(candidate_lons[index]), distance)
+                    for index, distance in hits]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 10, max_radius: float = 20038.0) -> list:
+        """
+        method definition for the k nearest open tasks. the search
+        radius starts at one cell and doubles until k tasks are in it
+        """
+        radius = self.cell_degrees * 111.2
+        while True:
+            found = self.within(latitude, longitude, radius, k)
+            if len(found) >= k or radius >= max_radius:
+                return found
+            radius = min(radius * 2, max_radius)
+
+
+"""
+built on first use; every query afterwards is served from memory
+"""
+task_grid = LazyObject(lambda: TaskGrid().start())
+
+
+def sync_task(session, task):
+    """
+    function definition that mirrors a committed task change into this
+    worker's grid when it is loaded. a cold grid is left to its first
+    build, and failures are only logged: the change is already
+    committed and the next rebuild repairs the grid
+    """
+    if not task_grid.initialized:
+        return
+    try:
+        task_grid.sync_task(session, task)
+    except Exception as e:
+        logger.error(f"Failed to sync task {task.id} into the grid: {e}")
+
+
+def sync_locations(session, location_ids):
+    """
+    function definition that re-places the tasks at moved locations in
+    this worker's grid when it is loaded, logging failures like sync_task
+    """
+    if not task_grid.initialized:
+        return
+    try:
+        task_grid.sync_locations(session, location_ids)
+    except Exception as e:
+        logger.error(f"Failed to sync moved locations into the grid: {e}")
+
+
+"""
+held while a background build of a cold grid is running
+"""
+_warming = threading.Lock()
+
+
+def warm_grid():
+    """
+    function definition that builds this worker's grid on a background
+    thread unless it is built or already building, so the request that
+    finds the grid cold does not wait for the first full load
+    """
+    if task_grid.initialized or not _warming.acquire(blocking=False):
+        return
+
+    def build():
+        try:
+            task_grid.resolve()
+        except Exception as e:
+            logger.error(f"Failed to build task grid: {e}")
+        finally:
+            _warming.release()
+
+    threading.Thread(target=build, name='task-grid-build', daemon=True).start()
+
+
+def grid_nearby(latitude: float, longitude: float, radius: float, limit: int, k: int = None):
+    """
+    function definition for the open tasks near a point from this
+    worker's grid, as (task_id, latitude, longitude, distance_km)
+    hits: the k nearest when k is given, else those within radius km.
+    returns None while the grid is cold (starting its build) or when
+    the query fails, so the caller can fall back to the database
+    """
+    if not task_grid.initialized:
+        warm_grid()
+        return None
+    try:
+        if k:
+            return task_grid.nearest(latitude, longitude, k)
+        return task_grid.within(latitude, longitude, radius, limit)
+    except Exception as e:
+        logger.error(f"Failed to query the task grid: {e}")
+        return None
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+"""
+lazy proxies for objects that are expensive to build,
+e.g database storage or clients for external services
+"""
+import threading
+
+
+class LazyObject:
+    """
+    class definition for a proxy that builds the wrapped object
+    on first attribute access instead of at import time
+    """
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def resolve(self):
+        """
+        method definition that returns the wrapped object,
+        building it exactly once even under concurrent first use
+        """
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
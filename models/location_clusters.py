@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+"""
+background mini-batch k-means over locations.
+every run folds a small batch of new/changed locations plus a rolling
+slice of the table into the centroids, reassigns those locations and
+stores the result as a new version, so the cost of a run does not
+depend on how many requests read the clusters
+
+usage:
+    python location_clusters.py run --interval 60
+    python location_clusters.py once
+    python location_clusters.py migrate
+"""
+import argparse
+import logging
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, and_, delete, func, or_
+from geo_distance import distance_matrix
+from lazy import LazyObject
+from schema import upgrade_table
+from sessions import background_session
+from storage import Storage
+from upserts import upsert
+from user import Base
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+storage = LazyObject(Storage)
+
+
+class LocationClusterRun(Base):
+    """
+    class definition for one published version of the clusters.
+    (watermark, watermark_id) is the (updated_at, id) of the newest
+    location folded in so far and cursor the last location id of the
+    rolling refresh
+    """
+    __tablename__ = 'location_cluster_runs'
+
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False)
+    cluster_count = Column(Integer, nullable=False)
+    point_count = Column(Integer, nullable=False)
+    watermark = Column(DateTime, nullable=True)
+    watermark_id = Column(Integer, nullable=False, default=0, server_default='0')
+    cursor = Column(Integer, nullable=False, default=0)
+
+
+class LocationCentroid(Base):
+    """
+    class definition for one centroid of a version. weight is how many
+    points it has absorbed (its mini-batch learning rate is 1 / weight),
+    size how many locations are currently assigned to it
+    """
+    __tablename__ = 'location_centroids'
+
+    version = Column(Integer, ForeignKey('location_cluster_runs.version', ondelete='CASCADE'), primary_key=True)
+    cluster = Column(Integer, primary_key=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    weight = Column(Float, nullable=False)
+    size = Column(Integer, nullable=False)
+
+
+class LocationClusterAssignment(Base):
+    """
+    class definition for the cluster a location was last assigned to
+    """
+    __tablename__ = 'location_cluster_assignments'
+
+    location_id = Column(Integer, ForeignKey('locations.id', ondelete='CASCADE'), primary_key=True)
+    cluster = Column(Integer, nullable=False, index=True)
+    version = Column(Integer, nullable=False)
+
+
+def _assign(session, ids, labels, version: int):
+    """
+    function definition that upserts location assignments. the caller commits
+    """
+    rows = [{'location_id': int(location_id), 'cluster': int(label), 'version': version}
+            for location_id, label in zip(ids, labels)]
+    upsert(session, LocationClusterAssignment.__table__, rows, ['location_id'],
+            lambda new: {'cluster': new.cluster, 'version': new.version})
+
+
+def _labels(points, centroids):
+    return np.argmin(distance_matrix(points[:, 0], points[:, 1], centroids[:, 0], centroids[:, 1]), axis=1)
+
+
+class ClusterService:
+    """
+    class definition for the background clustering job.
+    max_weight caps how much history a centroid remembers,
+    so centroids keep following where locations move
+    """
+    def __init__(self, clusters: int = 5, batch_size: int = 1024, interval: float = 60.0,
+            max_weight: float = 10000.0, keep_versions: int = 3):
+        self.clusters = clusters
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_weight = max_weight
+        self.keep_versions = keep_versions
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = None
+
+    def start(self):
+        if self._thread is None:
+            self._session = background_session(storage)
+            self._thread = threading.Thread(target=self._run, name='location-clustering', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once(self._session)
+            except Exception as e:
+                logger.error(f"Location clustering run failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def _publish(self, session, centroids, watermark, watermark_id, cursor, point_count) -> int:
+        run = LocationClusterRun(created_at=datetime.now(), cluster_count=len(centroids),
+                point_count=point_count, watermark=watermark, watermark_id=watermark_id, cursor=cursor)
+        session.add(run)
+        session.flush()
+        return run.version
+
+    def _finish(self, session, version, centroids, weights):
+        sizes = dict(session.query(LocationClusterAssignment.cluster, func.count())
+                .group_by(LocationClusterAssignment.cluster).all())
+        session.add_all([
+            LocationCentroid(version=version, cluster=k, latitude=float(centroids[k, 0]),
+                longitude=float(centroids[k, 1]), weight=float(weights[k]), size=sizes.get(k, 0))
+            for k in range(len(centroids))
+            ])
+        stale = (session.query(LocationClusterRun.version)
+                .order_by(LocationClusterRun.version.desc())
+                .offset(self.keep_versions).all())
+        if stale:
+            stale = [row.version for row in stale]
+            session.execute(delete(LocationCentroid).where(LocationCentroid.version.in_(stale)))
+            session.execute(delete(LocationClusterRun).where(LocationClusterRun.version.in_(stale)))
+        session.commit()
+
+    def initialize(self, session) -> int:
+        """
+        method definition for the first version: a full k-means pass,
+        then every location assigned in keyset batches
+        """
+        from locations import Location
+
+        centroids = np.asarray(Location.cluster_locations(session, self.clusters), dtype=np.float64)
+        if len(centroids) == 0:
+            return None
+        watermark = session.query(func.max(Location.updated_at)).scalar()
+        watermark_id = session.query(func.max(Location.id)).filter(Location.updated_at == watermark).scalar()
+        point_count = session.query(func.count(Location.id)).scalar()
+        version = self._publish(session, centroids, watermark, watermark_id or 0, 0, point_count)
+
+        weights = np.zeros(len(centroids))
+        last_id = 0
+        while True:
+            rows = (session.query(Location.id, Location.latitude, Location.longitude)
+                    .filter(Location.id > last_id).order_by(Location.id)
+                    .limit(self.batch_size * 10).all())
+            if not rows:
+                break
+            points = np.array([(row.latitude, row.longitude) for row in rows], dtype=np.float64)
+            labels = _labels(points, centroids)
+            weights += np.bincount(labels, minlength=len(centroids))
+            _assign(session, [row.id for row in rows], labels, version)
+            last_id = rows[-1].id
+
+        self._finish(session, version, centroids, np.minimum(weights, self.max_weight))
+        return version
+
+    def run_once(self, session) -> int:
+        """
+        method definition for one incremental run. returns the
+        published version, or the current one when nothing changed
+        """
+        from locations import Location
+
+        try:
+            latest = session.query(LocationClusterRun).order_by(LocationClusterRun.version.desc()).first()
+            if latest is None:
+                return self.initialize(session)
+
+            stored = (session.query(LocationCentroid)
+                    .filter(LocationCentroid.version == latest.version)
+                    .order_by(LocationCentroid.cluster).all())
+            centroids = np.array([(c.latitude, c.longitude) for c in stored], dtype=np.float64)
+            weights = np.array([c.weight for c in stored], dtype=np.float64)
+
+            columns = (Location.id, Location.latitude, Location.longitude, Location.updated_at)
+            changed = session.query(*columns)
+            if latest.watermark is not None:
+                changed = changed.filter(or_(Location.updated_at > latest.watermark, and_(
+                    Location.updated_at == latest.watermark, Location.id > latest.watermark_id)))
+            changed = changed.order_by(Location.updated_at, Location.id).limit(self.batch_size).all()
+            rolling = (session.query(*columns).filter(Location.id > latest.cursor)
+                    .order_by(Location.id).limit(self.batch_size).all())
+
+            batch = {row.id: row for row in rolling}
+            batch.update({row.id: row for row in changed})
+            if not batch:
+                session.rollback()
+                return latest.version
+
+            ids = list(batch)
+            points = np.array([(batch[i].latitude, batch[i].longitude) for i in ids], dtype=np.float64)
+            labels = _labels(points, centroids)
+            for k in range(len(centroids)):
+                members = points[labels == k]
+                if len(members):
+                    total = weights[k] + len(members)
+                    centroids[k] = (centroids[k] * weights[k] + members.sum(axis=0)) / total
+                    weights[k] = min(total, self.max_weight)
+            labels = _labels(points, centroids)
+
+            if changed:
+                watermark, watermark_id = changed[-1].updated_at, changed[-1].id
+            else:
+                watermark, watermark_id = latest.watermark, latest.watermark_id
+            cursor = rolling[-1].id if len(rolling) == self.batch_size else 0
+            point_count = session.query(func.count(Location.id)).scalar()
+            version = self._publish(session, centroids, watermark, watermark_id, cursor, point_count)
+            _assign(session, ids, labels, version)
+            self._finish(session, version, centroids, weights)
+            return version
+        except Exception:
+            session.rollback()
+            raise
+
+
+class ClusterSnapshot:
+    """
+    class definition for the latest published clusters as served to
+    clients, re-read from the database at most every `ttl` seconds
+    """
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._expires = 0.0
+        self._payload = None
+
+    def get(self, session) -> dict:
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self._payload
+
+        run = session.query(LocationClusterRun).order_by(LocationClusterRun.version.desc()).first()
+        payload = None
+        if run is not None:
+            if self._payload is not None and self._payload['version'] == run.version:
+                payload = self._payload
+            else:
+                centroids = (session.query(LocationCentroid)
+                        .filter(LocationCentroid.version == run.version)
+                        .order_by(LocationCentroid.cluster).all())
+                payload = {
+                        'version': run.version,
+                        'computed_at': run.created_at.isoformat(),
+                        'point_count': run.point_count,
+                        'clusters': [[c.latitude, c.longitude] for c in centroids],
+                        'sizes': [c.size for c in centroids],
+                        }
+
+        with self._lock:
+            self._payload = payload
+            self._expires = time.monotonic() + self.ttl
+        return payload
+
+
+cluster_snapshot = ClusterSnapshot()
+
+"""
+in-process clustering for single-worker deployments;
+otherwise run `python location_clusters.py run` next to the app
+"""
+cluster_service = LazyObject(lambda: ClusterService().start())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cluster locations in the background')
+    parser.add_argument('command', choices=['run', 'once', 'migrate'])
+    parser.add_argument('--clusters', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--interval', type=float, default=60.0)
+    args = parser.parse_args()
+
+    service = ClusterService(args.clusters, args.batch_size, args.interval)
+    if args.command == 'migrate':
+        from locations import Location
+
+        for model in (Location, LocationClusterRun, LocationCentroid, LocationClusterAssignment):
+            print(model.__tablename__, upgrade_table(storage.session, model.__table__))
+    elif args.command == 'once':
+        print(service.run_once(storage.session))
+    else:
+        service.start()._thread.join()
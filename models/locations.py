@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+this is the locations model for our platform
+
+usage:
+    python locations.py migrate
+    python locations.py backfill
+"""
+import argparse
+import logging
+import pytz
+import numpy as np
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, and_, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, contains_eager
+from geo import bounding_box, covering_cells, geohash_encode, longitude_ranges
+from geo_distance import distance_matrix, within_radius
+from schema import upgrade_table
+from upserts import upsert
+from user import Base
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+EAT = pytz.timezone('Africa/Nairobi')
+
+"""
+precision of the stored geohash (~5m cells). searches match on
+a shorter prefix, so one stored key serves every radius
+"""
+GEOHASH_PRECISION = 9
+MAX_NEARBY_RESULTS = 200
+
+
+class Location(Base):
+    """
+    class definition for the locations model
+    """
+    __tablename__ = 'locations'
+    __table_args__ = (
+            Index('ix_locations_lat_lon', 'latitude', 'longitude'),
+            Index('ix_locations_updated_id', 'updated_at', 'id'),
+            )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    """
+    set on the one location that follows a user's position pings
+    """
+    tracked_user_id = Column(Integer, ForeignKey('users.id'), unique=True, index=True, nullable=True)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    geohash = Column(String(GEOHASH_PRECISION), index=True)
+    address = Column(String(255), default='')
+    radius = Column(Float, default=18.0)
+    created_at = Column(DateTime, default=lambda: datetime.now(EAT))
+    updated_at = Column(DateTime, default=lambda: datetime.now(EAT), onupdate=lambda: datetime.now(EAT))
+
+    def create_location(self, user_id, latitude, longitude, address='', radius=18.0):
+        """
+        method definition that fills in a new location
+        """
+        self.user_id = user_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = geohash_encode(latitude, longitude, GEOHASH_PRECISION)
+        self.address = address
+        self.radius = radius
+
+    def update_location(self, latitude=None, longitude=None, address=None, radius=None):
+        """
+        method definition that updates the given fields of a location,
+        keeping its geohash in step with its coordinates
+        """
+        if latitude is not None:
+            self.latitude = latitude
+        if longitude is not None:
+            self.longitude = longitude
+        if address is not None:
+            self.address = address
+        if radius is not None:
+            self.radius = radius
+        self.geohash = geohash_encode(self.latitude, self.longitude, GEOHASH_PRECISION)
+
+    @staticmethod
+    def upsert_positions(session: Session, pings, batch_size: int = 1000) -> list:
+        """
+        method definition that moves each user's tracked location to
+        their latest ping (creating it on the first one) with multi-row
+        upserts in one transaction. pings are dicts of user_id, latitude,
+        longitude and optionally address, already deduplicated by user.
+        a ping without an address keeps the one already stored.
+        returns the ids of the upserted locations
+        """
+        if not pings:
+            return []
+        now = datetime.now(EAT)
+        rows = [{
+            'tracked_user_id': ping['user_id'],
+            'user_id': ping['user_id'],
+            'latitude': ping['latitude'],
+            'longitude': ping['longitude'],
+            'geohash': geohash_encode(ping['latitude'], ping['longitude'], GEOHASH_PRECISION),
+            'address': ping.get('address') or '',
+            'radius': 18.0,
+            'created_at': now,
+            'updated_at': now,
+            } for ping in pings]
+        table = Location.__table__
+
+        def moved(new):
+            return {'latitude': new.latitude, 'longitude': new.longitude,
+                    'geohash': new.geohash, 'updated_at': new.updated_at,
+                    'address': func.coalesce(func.nullif(new.address, ''), table.c.address)}
+
+        try:
+            for i in range(0, len(rows), batch_size):
+                upsert(session, table, rows[i:i + batch_size], ['tracked_user_id'], moved)
+
+            user_ids = [row['tracked_user_id'] for row in rows]
+            location_ids = []
+            for i in range(0, len(user_ids), batch_size):
+                location_ids += [row.id for row in session.query(Location.id).filter(
+                    Location.tracked_user_id.in_(user_ids[i:i + batch_size]))]
+            session.commit()
+            return location_ids
+        except SQLAlchemyError as e:
+            logger.error(f"Error upserting {len(rows)} positions: {e}")
+            session.rollback()
+            raise
+
+    @staticmethod
+    def fetch_locations(session: Session, user_id=None, task_id=None):
+        """
+        method definition that fetches locations by user and/or task
+        """
+        from tasks import Task
+
+        try:
+            query = session.query(Location)
+            if user_id:
+                query = query.filter(Location.user_id == user_id)
+            if task_id:
+                query = query.join(Task, Task.location_id == Location.id).filter(Task.id == task_id)
+            return query.all()
+        except SQLAlchemyError as e:
+            logger.error(f"Error fetching locations: {e}")
+            raise
+
+    @staticmethod
+    def nearby_filter(latitude: float, longitude: float, radius: float):
+        """
+        method definition for the SQL prefilter of points that may be
+        within radius km: the geohash cells covering the bounding box
+        (index range scans on the geohash prefix) && the box itself
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius)
+        cells = covering_cells(min_lat, max_lat, min_lon, max_lon)
+        conditions = [Location.latitude.between(min_lat, max_lat), or_(*[
+            Location.longitude.between(low, high) for low, high in longitude_ranges(min_lon, max_lon)])]
+        if cells != {''}:
+            conditions.append(or_(*[Location.geohash.like(f"{cell}%") for cell in sorted(cells)]))
+        return and_(*conditions)
+
+    @staticmethod
+    def find_nearby_tasks(session: Session, latitude: float, longitude: float,
+            radius: float = 18.0, limit: int = 50):
+        """
+        method definition that returns the open tasks within radius km,
+        nearest first. the index narrows candidates to the cells
+        around the point, then exact haversine distances filter
+        && order them. each task gets a `distance_km` attribute, and
+        its `location` is already loaded
+        """
+        from tasks import Task, TaskStatusEnum
+
+        limit = min(max(limit, 1), MAX_NEARBY_RESULTS)
+        try:
+            candidates = (session.query(Task)
+                    .join(Location, Task.location_id == Location.id)
+                    .options(contains_eager(Task.location))
+                    .filter(Location.nearby_filter(latitude, longitude, radius),
+                        Task.assigned_tasker_id.is_(None),
+                        or_(Task.status.is_(None), Task.status == TaskStatusEnum.PENDING))
+                    .all())
+        except SQLAlchemyError as e:
+            logger.error(f"Error finding nearby tasks: {e}")
+            raise
+
+        hits = within_radius(latitude, longitude, [task.location.latitude for task in candidates],
+                [task.location.longitude for task in candidates], radius, limit)
+        nearby = []
+        for index, distance in hits:
+            task = candidates[index]
+            task.distance_km = round(distance, 3)
+            nearby.append(task)
+        return nearby
+
+    @staticmethod
+    def cluster_locations(session: Session, clusters: int = 5, iterations: int = 20):
+        """
+        method definition that groups locations with k-means,
+        assigning points by haversine distance, and returns the
+        cluster centroids as a (clusters, 2) array of (latitude, longitude)
+        """
+        points = np.array(session.query(Location.latitude, Location.longitude).all(), dtype=np.float64)
+        if len(points) == 0:
+            return np.empty((0, 2))
+        clusters = min(clusters, len(points))
+        centroids = points[np.random.default_rng(0).choice(len(points), clusters, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmin(distance_matrix(points[:, 0], points[:, 1], centroids[:, 0], centroids[:, 1]), axis=1)
+            for k in range(clusters):
+                members = points[labels == k]
+                if len(members):
+                    centroids[k] = members.mean(axis=0)
+        return centroids
+
+    @staticmethod
+    def backfill_geohashes(session: Session, batch_size: int = 1000):
+        """
+        method definition that sets the geohash of locations
+        created before it was stored
+        """
+        while True:
+            locations = session.query(Location).filter(Location.geohash.is_(None)).limit(batch_size).all()
+            if not locations:
+                return
+            for location in locations:
+                location.geohash = geohash_encode(location.latitude, location.longitude, GEOHASH_PRECISION)
+            session.commit()
+
+
+if __name__ == "__main__":
+    from storage import Storage
+
+    parser = argparse.ArgumentParser(description='Locations maintenance')
+    parser.add_argument('command', choices=['migrate', 'backfill'], nargs='?', default='backfill')
+    args = parser.parse_args()
+
+    session = Storage().session
+    if args.command == 'migrate':
+        print(upgrade_table(session, Location.__table__))
+    Location.backfill_geohashes(session)
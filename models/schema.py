@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""
+in-place schema upgrades for tables that gained columns or indexes
+after they were first created
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+
+def upgrade_table(session, table) -> list:
+    """
+    function definition that creates a model's table, or adds the
+    columns and indexes it is missing, then commits. added columns
+    must be nullable or have a server default; their foreign keys are
+    not added, so uniqueness has to come from a unique index. returns
+    the names of what was added
+    """
+    connection = session.connection()
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        table.create(connection)
+        session.commit()
+        return [table.name]
+
+    added = []
+    columns = {column['name'] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in columns:
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            added.append(column.name)
+
+    indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(connection)
+            added.append(index.name)
+    session.commit()
+    return added
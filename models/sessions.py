@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+"""
+database sessions for background threads
+"""
+from sqlalchemy.orm import Session
+
+
+def background_session(storage) -> Session:
+    """
+    function definition for a session owned by one background thread,
+    bound to the same engine as storage. the storage session is shared
+    by the whole process, so a commit or rollback there from a thread
+    would also commit or discard other threads' pending work
+    """
+    return Session(bind=storage.session.get_bind())
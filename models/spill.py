@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+local NDJSON spill files for rows that could not reach the database
+"""
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.ERROR)
+
+
+class SpillFile:
+    """
+    class definition for an append-only file of rows to be written
+    later. each replay rotates the file to a new numbered replay file
+    and records how far into it has been committed, so a failed
+    replay resumes where it stopped instead of writing rows twice
+    """
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    def append(self, rows: list):
+        """
+        method definition that durably appends rows
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row, default=_encode) + '\n')
+                spill_file.flush()
+                os.fsync(spill_file.fileno())
+
+    def _replay_paths(self) -> list:
+        """
+        method definition for the pending replay files, oldest first
+        """
+        pattern = re.compile(re.escape(self.path) + r'\.replay(?:\.(\d+))?$')
+        found = []
+        for path in glob.glob(glob.escape(self.path) + '.replay*'):
+            match = pattern.match(path)
+            if match:
+                found.append((int(match.group(1) or 0), path))
+        return [path for _, path in sorted(found)]
+
+    def replay(self, write_batch):
+        """
+        method definition that passes spilled rows to write_batch in
+        batches, oldest first. the file is always renamed first, so new
+        spills start a fresh file even while an older replay keeps
+        failing. the first failed batch stops the replay and is raised
+        """
+        with self._lock:
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.replay.{time.time_ns()}")
+
+        for replay_path in self._replay_paths():
+            self._replay_file(replay_path, write_batch)
+
+    def _replay_file(self, replay_path: str, write_batch):
+        """
+        method definition that writes one replay file in batches,
+        saving the byte offset after each committed batch
+        """
+        offset_path = f"{replay_path}.offset"
+        offset = 0
+        if os.path.exists(offset_path):
+            with open(offset_path) as offset_file:
+                offset = int(offset_file.read().strip() or 0)
+
+        with open(replay_path, 'rb') as replay_file:
+            replay_file.seek(offset)
+            batch = []
+            while True:
+                line = replay_file.readline()
+                if line.strip():
+                    try:
+                        batch.append(json.loads(line, object_hook=_decode))
+                    except ValueError:
+                        logger.error(f"Skipping corrupt line in {replay_path} at byte {replay_file.tell()}")
+                if batch and (len(batch) >= self.batch_size or not line):
+                    write_batch(batch)
+                    batch = []
+                    _save_offset(offset_path, replay_file.tell())
+                if not line:
+                    break
+
+        os.remove(replay_path)
+        if os.path.exists(offset_path):
+            os.remove(offset_path)
+
+
+def _save_offset(offset_path: str, offset: int):
+    """
+    function definition that atomically records a replay offset
+    """
+    with open(f"{offset_path}.tmp", 'w') as offset_file:
+        offset_file.write(str(offset))
+        offset_file.flush()
+        os.fsync(offset_file.fileno())
+    os.replace(f"{offset_path}.tmp", offset_path)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return str(value)
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
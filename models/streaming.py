@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+helpers for exporting large tables in constant memory:
+keyset paging, incremental JSON/NDJSON/CSV encoding and gzip
+"""
+import csv
+import io
+import itertools
+import json
+import zlib
+
+EXPORT_FORMATS = {
+        'json': 'application/json',
+        'jsonl': 'application/x-ndjson',
+        'csv': 'text/csv',
+        }
+
+
+def keyset_pages(query, key_column, batch_size: int = 1000):
+    """
+    function definition that yields the rows of a query page by page,
+    using `key_column > last key` instead of OFFSET so every page
+    is an index range scan. the key column must be the first column
+    selected by the query
+    """
+    last_key = None
+    while True:
+        page = query
+        if last_key is not None:
+            page = page.filter(key_column > last_key)
+        rows = page.order_by(key_column).limit(batch_size).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_key = rows[-1][0]
+
+
+def encode_rows(records, file_format: str, fieldnames: list, batch_size: int = 1000):
+    """
+    function definition that encodes dicts into text chunks of
+    roughly `batch_size` records each
+        *json -> a single JSON array, written incrementally
+        *jsonl -> one JSON object per line
+        *csv -> a header row followed by one row per record
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError("unsupported file format. Use json/jsonl/csv.")
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    if file_format == 'csv':
+        writer.writeheader()
+    elif file_format == 'json':
+        buffer.write('[')
+
+    count = 0
+    for record in records:
+        if file_format == 'csv':
+            writer.writerow(record)
+        elif file_format == 'jsonl':
+            buffer.write(json.dumps(record, default=str) + '\n')
+        else:
+            buffer.write((',\n' if count else '\n') + json.dumps(record, default=str))
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if file_format == 'json':
+        buffer.write('\n]\n')
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """
+    function definition that gzips text chunks on the fly
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def byte_chunks(chunks, compress: bool = False):
+    """
+    function definition that turns text chunks into bytes,
+    gzipped when `compress` is set
+    """
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode() for chunk in chunks)
+
+
+def started(chunks):
+    """
+    function definition that pulls the first chunk of a lazy export
+    right away, so its first query runs (and fails) while the caller
+    can still answer with an error instead of a truncated 200.
+    returns an iterator over that chunk and the rest
+    """
+    chunks = iter(chunks)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+    return itertools.chain((first,), chunks)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+multi-row upserts on the dialects the platform runs on
+"""
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+
+def upsert(session, table, rows: list, keys: list, set_):
+    """
+    function definition that inserts rows with one multi-row statement.
+    rows whose `keys` (a unique key of the table) already exist get the
+    columns of the map `set_(new)` instead, where `new` holds the
+    incoming row's columns (VALUES() on MySQL, EXCLUDED elsewhere).
+    works on a session or a connection; the caller commits
+    """
+    if not rows:
+        return None
+    bind = session.get_bind() if hasattr(session, 'get_bind') else session
+    dialect = bind.dialect.name
+
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(set_(stmt.inserted))
+    elif dialect in ('postgresql', 'sqlite'):
+        stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c[key] for key in keys], set_=set_(stmt.excluded))
+    else:
+        raise NotImplementedError(f"Upsert is not supported on {dialect}")
+
+    return session.execute(stmt)
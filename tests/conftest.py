@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""
+test setup: models/ and app/ are importable the way the app and the
+maintenance scripts import them. the models import `user` && `storage`
+from the deployment; when those are absent a declarative Base and an
+in-memory SQLite storage stand in for them
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'models'))
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+
+try:
+    import user  # noqa: F401
+except ImportError:
+    from sqlalchemy import Column, Integer
+    from sqlalchemy.orm import declarative_base
+
+    user = types.ModuleType('user')
+    user.Base = declarative_base()
+
+    class User(user.Base):
+        __tablename__ = 'users'
+        id = Column(Integer, primary_key=True)
+
+    user.User = User
+    sys.modules['user'] = user
+
+try:
+    import storage  # noqa: F401
+except ImportError:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import scoped_session, sessionmaker
+
+    class Storage:
+        def __init__(self):
+            self.session = scoped_session(sessionmaker(bind=create_engine('sqlite://')))
+
+        def query(self, *args):
+            return self.session.query(*args)
+
+    storage = types.ModuleType('storage')
+    storage.Storage = Storage
+    sys.modules['storage'] = storage
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+"""
+tests for the versioned trend result cache
+"""
+from analytics_cache import TrendCache
+
+
+class Versions:
+    def __init__(self):
+        self.version = 1
+        self.reads = 0
+
+    def __call__(self, metric_type):
+        self.reads += 1
+        return self.version
+
+
+def test_versions_are_read_once_per_version_ttl():
+    versions = Versions()
+    cache = TrendCache(version_of=versions, version_ttl=60)
+    for _ in range(3):
+        assert cache.cached('key', 'clicks', lambda: 'result') == 'result'
+    assert versions.reads == 1
+    assert cache.hits == 2
+
+
+def test_another_workers_write_shows_once_the_version_expires():
+    versions = Versions()
+    cache = TrendCache(version_of=versions, version_ttl=0)
+    cache.cached('key', 'clicks', lambda: 'old')
+    versions.version = 2
+    assert cache.cached('key', 'clicks', lambda: 'new') == 'new'
+
+
+def test_local_invalidation_rereads_the_version():
+    versions = Versions()
+    cache = TrendCache(version_of=versions, version_ttl=60)
+    cache.cached('key', 'clicks', lambda: 'old')
+    versions.version = 2
+    cache.invalidate({'clicks'})
+    assert cache.cached('key', 'clicks', lambda: 'new') == 'new'
+    assert cache.cached('key', 'clicks', lambda: 'newer') == 'new'
+    assert versions.reads == 2
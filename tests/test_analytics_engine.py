@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+tests for the columnar trend engine
+"""
+import numpy as np
+import pytest
+from analytics_engine import MAX_BUCKETS, MetricWindow, TrendEngine, bucket_count, parse_bucket
+
+
+def window(rows, start=0.0, end=7200.0):
+    types = sorted({name for _, _, name in rows})
+    return MetricWindow(
+            np.array([row[0] for row in rows], dtype=np.float64),
+            np.array([row[1] for row in rows], dtype=np.float64),
+            np.array([types.index(row[2]) for row in rows], dtype=np.int32),
+            types, start, end)
+
+
+def test_parse_bucket():
+    assert parse_bucket('15m') == 900
+    assert parse_bucket('1d') == 86400
+    with pytest.raises(ValueError):
+        parse_bucket('0h')
+    with pytest.raises(ValueError):
+        parse_bucket('1w')
+
+
+def test_bucket_count_is_capped():
+    assert bucket_count(0, 7200, 3600) == 2
+    with pytest.raises(ValueError):
+        bucket_count(0, (MAX_BUCKETS + 1) * 60, 60)
+
+
+def test_scalar_statistics_per_metric_type():
+    rows = [(10, 1, 'latency'), (20, 2, 'latency'), (30, 3, 'latency'), (40, 100, 'errors')]
+    stats = TrendEngine().compute(window(rows), ['count', 'mean', 'min', 'max', 'p50'])
+    assert stats['latency'] == {'count': 3, 'mean': 2.0, 'min': 1.0, 'max': 3.0, 'p50': 2.0}
+    assert stats['errors']['count'] == 1
+
+
+def test_series_leaves_empty_buckets_empty():
+    rows = [(10, 2, 'latency'), (20, 4, 'latency')]
+    stats = TrendEngine(bucket_seconds=3600, alpha=0.5).compute(window(rows), ['series', 'ewma', 'rolling'])
+    assert stats['latency']['series'] == [3.0, None]
+    assert stats['latency']['ewma'] == [3.0, 3.0]
+    assert stats['latency']['rolling'] == [3.0, 3.0]
+
+
+def test_unknown_statistics_are_rejected():
+    with pytest.raises(ValueError):
+        TrendEngine().compute(window([(10, 1, 'latency')]), ['median'])
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+"""
+tests for the audit log full-text search queries
+"""
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+import audit_search
+
+
+def compile_mysql(query) -> str:
+    return str(query.statement.compile(dialect=mysql.dialect()))
+
+
+def test_fulltext_query_builds_on_mysql():
+    sql = compile_mysql(audit_search.search_query(Session(), ['disk', 'full'], 'and', fulltext=True))
+    assert 'MATCH (audit_logs.details) AGAINST (%s IN BOOLEAN MODE)' in sql
+    assert 'ORDER BY MATCH (audit_logs.details) AGAINST (%s IN BOOLEAN MODE) DESC' in sql
+
+
+def test_fulltext_query_requires_every_term_in_and_mode():
+    query = audit_search.search_query(Session(), ['disk', 'full'], 'and', fulltext=True)
+    params = query.statement.compile(dialect=mysql.dialect()).params
+    assert '+disk +full' in params.values()
+
+
+def test_token_query_builds_on_mysql():
+    sql = compile_mysql(audit_search.search_query(Session(), ['disk', 'full'], 'or', fulltext=False))
+    assert 'audit_log_tokens' in sql
+    assert 'HAVING' not in sql
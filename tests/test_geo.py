@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+"""
+tests for the geohash && distance helpers behind the location index
+"""
+import pytest
+from geo import (bounding_box, covering_cells, geohash_encode,
+        haversine_km, longitude_ranges)
+
+
+def test_geohash_matches_reference_value():
+    assert geohash_encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert geohash_encode(57.64911, 10.40744, 5) == 'u4pru'
+
+
+def test_haversine_one_degree_on_the_equator():
+    assert haversine_km(0, 0, 0, 1) == pytest.approx(111.195, abs=0.01)
+    assert haversine_km(-1.2921, 36.8219, -1.2921, 36.8219) == 0
+
+
+def test_bounding_box_contains_the_radius():
+    min_lat, max_lat, min_lon, max_lon = bounding_box(-1.2921, 36.8219, 10)
+    assert haversine_km(-1.2921, 36.8219, max_lat, 36.8219) == pytest.approx(10, rel=1e-6)
+    assert haversine_km(-1.2921, 36.8219, -1.2921, max_lon) >= 10
+    assert min_lat < -1.2921 < max_lat and min_lon < 36.8219 < max_lon
+
+
+def test_bounding_box_at_a_pole_spans_every_longitude():
+    assert bounding_box(89.99, 0, 50)[2:] == (-180.0, 180.0)
+
+
+def test_longitude_ranges_split_at_the_antimeridian():
+    assert longitude_ranges(170, 190) == [(170, 180.0), (-180.0, -170)]
+    assert longitude_ranges(-190, -170) == [(170, 180.0), (-180.0, -170)]
+    assert longitude_ranges(10, 20) == [(10, 20)]
+
+
+def test_covering_cells_contain_every_point_of_the_box():
+    box = bounding_box(-1.2921, 36.8219, 5)
+    cells = covering_cells(*box)
+    precision = len(next(iter(cells)))
+    for latitude in (box[0], -1.2921, box[1]):
+        for longitude in (box[2], 36.8219, box[3]):
+            assert geohash_encode(latitude, longitude, precision) in cells
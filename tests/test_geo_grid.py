@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+tests for the in-memory grid of open tasks
+"""
+import pytest
+import geo_grid
+from geo import haversine_km
+from geo_grid import TaskGrid
+from lazy import LazyObject
+
+
+def grid_with(points):
+    grid = TaskGrid(cell_degrees=0.1)
+    for task_id, (latitude, longitude) in points.items():
+        grid.upsert(task_id, latitude, longitude)
+    return grid
+
+
+def test_within_returns_nearest_first():
+    grid = grid_with({1: (-1.30, 36.82), 2: (-1.29, 36.82), 3: (-1.00, 36.82)})
+    hits = grid.within(-1.29, 36.82, 5)
+    assert [hit[0] for hit in hits] == [2, 1]
+    assert hits[1][3] == pytest.approx(haversine_km(-1.29, 36.82, -1.30, 36.82))
+
+
+def test_upsert_moves_a_task_between_cells():
+    grid = grid_with({1: (-1.29, 36.82)})
+    grid.upsert(1, 10.0, 10.0)
+    assert len(grid) == 1
+    assert grid.within(-1.29, 36.82, 5) == []
+    assert [hit[0] for hit in grid.within(10.0, 10.0, 1)] == [1]
+
+
+def test_remove_keeps_the_arrays_dense():
+    grid = grid_with({1: (-1.29, 36.82), 2: (-1.28, 36.82), 3: (-1.27, 36.82)})
+    grid.remove(1)
+    grid.remove(42)
+    assert len(grid) == 2
+    assert sorted(hit[0] for hit in grid.within(-1.28, 36.82, 10)) == [2, 3]
+    grid.upsert(3, -1.28, 36.83)
+    assert sorted(hit[0] for hit in grid.within(-1.28, 36.82, 10)) == [2, 3]
+
+
+def test_nearest_widens_until_k_tasks():
+    grid = grid_with({1: (0.0, 0.0), 2: (0.0, 1.0), 3: (0.0, 3.0)})
+    assert [hit[0] for hit in grid.nearest(0.0, 0.0, k=2)] == [1, 2]
+    assert len(grid.nearest(0.0, 0.0, k=10, max_radius=1000)) == 3
+
+
+def test_grid_nearby_falls_back_while_the_grid_is_cold(monkeypatch):
+    warmed = []
+    monkeypatch.setattr(geo_grid, 'task_grid', LazyObject(lambda: grid_with({1: (0.0, 0.0)})))
+    monkeypatch.setattr(geo_grid, 'warm_grid', lambda: warmed.append(True))
+    assert geo_grid.grid_nearby(0.0, 0.0, 5, 50) is None
+    assert warmed == [True]
+
+    geo_grid.task_grid.resolve()
+    assert [hit[0] for hit in geo_grid.grid_nearby(0.0, 0.0, 5, 50)] == [1]
+    assert [hit[0] for hit in geo_grid.grid_nearby(0.0, 0.0, 5, 50, k=1)] == [1]
+
+
+def test_grid_nearby_falls_back_when_the_query_fails(monkeypatch):
+    grid = grid_with({1: (0.0, 0.0)})
+    monkeypatch.setattr(grid, 'within', lambda *args: 1 / 0)
+    monkeypatch.setattr(geo_grid, 'task_grid', LazyObject(lambda: grid))
+    geo_grid.task_grid.resolve()
+    assert geo_grid.grid_nearby(0.0, 0.0, 5, 50) is None
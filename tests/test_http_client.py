@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+"""
+tests for the per-host circuit breaker of the Pesapal HTTP client
+"""
+import time
+from services.http_client import CircuitBreaker, PesaPalHttpClient
+
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_half_open_allows_one_trial_call():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_and_release_frees_the_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_client_keeps_one_breaker_per_host():
+    client = PesaPalHttpClient()
+    assert client.breaker('https://pay.example.com/a') is client.breaker('https://pay.example.com/b')
+    assert client.breaker('https://pay.example.com/a') is not client.breaker('https://other.example.com/')
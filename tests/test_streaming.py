@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+tests for the chunked export encoders
+"""
+import csv
+import gzip
+import io
+import json
+import pytest
+from streaming import byte_chunks, encode_rows, started
+
+FIELDS = ['id', 'name']
+RECORDS = [{'id': i, 'name': f"row {i}"} for i in range(5)]
+
+
+def test_json_is_one_array_across_chunks():
+    chunks = list(encode_rows(RECORDS, 'json', FIELDS, batch_size=2))
+    assert len(chunks) == 3
+    assert json.loads(''.join(chunks)) == RECORDS
+
+
+def test_json_of_no_records_is_an_empty_array():
+    assert json.loads(''.join(encode_rows([], 'json', FIELDS))) == []
+
+
+def test_jsonl_has_one_record_per_line():
+    lines = ''.join(encode_rows(RECORDS, 'jsonl', FIELDS)).splitlines()
+    assert [json.loads(line) for line in lines] == RECORDS
+
+
+def test_csv_has_a_header_then_rows():
+    rows = list(csv.DictReader(io.StringIO(''.join(encode_rows(RECORDS, 'csv', FIELDS, batch_size=2)))))
+    assert [int(row['id']) for row in rows] == [0, 1, 2, 3, 4]
+    assert rows[0]['name'] == 'row 0'
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        list(encode_rows(RECORDS, 'xml', FIELDS))
+
+
+def test_compressed_chunks_are_one_gzip_stream():
+    data = b''.join(byte_chunks(encode_rows(RECORDS, 'jsonl', FIELDS, batch_size=2), compress=True))
+    assert gzip.decompress(data).decode().count('\n') == 5
+
+
+def test_started_runs_the_source_before_returning():
+    def failing():
+        raise RuntimeError("query failed")
+        yield
+
+    with pytest.raises(RuntimeError):
+        started(byte_chunks(encode_rows(failing(), 'csv', FIELDS)))
+
+
+def test_started_keeps_every_chunk():
+    chunks = list(started(encode_rows(RECORDS, 'jsonl', FIELDS, batch_size=2)))
+    assert len(chunks) == 3
+    assert list(started([])) == []
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+tests for the process-wide access token cache
+"""
+import threading
+import time
+from services.token_cache import TokenCache
+
+
+def test_concurrent_callers_share_one_fetch():
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(1)
+        return 'token', time.time() + 3600
+
+    cache = TokenCache(fetch)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(cache.get_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert tokens == ['token'] * 8
+    assert len(calls) == 1
+
+
+def test_short_lived_token_is_not_refreshed_in_a_loop():
+    cache = TokenCache(lambda: ('token', time.time() + 1), refresh_margin=60, min_refresh_delay=5)
+    before = time.time()
+    cache.get_token()
+    assert cache._refresh_at >= before + 5
+    cache._timer.cancel()
+
+
+def test_invalidate_only_drops_the_rejected_token():
+    tokens = iter(['first', 'second'])
+    cache = TokenCache(lambda: (next(tokens), time.time() + 3600))
+    assert cache.get_token() == 'first'
+    cache.invalidate('stale')
+    assert cache.peek() == 'first'
+    cache.invalidate('first')
+    assert cache.peek() is None
+    assert cache.get_token() == 'second'
+    cache._timer.cancel()
+
+
+def test_failed_fetch_frees_the_in_flight_slot():
+    attempts = []
+
+    def fetch():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('token endpoint down')
+        return 'token', time.time() + 3600
+
+    cache = TokenCache(fetch)
+    try:
+        cache.get_token()
+    except RuntimeError:
+        pass
+    assert cache.get_token() == 'token'
+    cache._timer.cancel()